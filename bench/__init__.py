@@ -0,0 +1,6 @@
+# Benchmarks for ttfutil and ttfc-extract.
+#
+#   python -m bench [options]
+#
+# fontgen builds synthetic TTF/TTC files in memory, so that no real (large,
+# licensed) font has to be committed; scenarios times ttfutil on them.
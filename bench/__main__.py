@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from bench import fontgen, scenarios
+
+
+parser = argparse.ArgumentParser(
+    prog='python -m bench',
+    description='Times ttfutil on synthetic fonts and prints the results '
+                'as JSON.',
+)
+parser.add_argument(
+    '-n', '--glyphs', type=int, default=2000,
+    help='number of glyphs per font (default: %(default)s)',
+)
+parser.add_argument(
+    '--contours', type=int, default=3,
+    help='contours per simple glyph (default: %(default)s)',
+)
+parser.add_argument(
+    '--points', type=int, default=24,
+    help='points per contour (default: %(default)s)',
+)
+parser.add_argument(
+    '--off-curve', type=float, default=0.5,
+    help='ratio of off-curve points (default: %(default)s)',
+)
+parser.add_argument(
+    '--composite-ratio', type=float, default=0.2,
+    help='ratio of composite glyphs (default: %(default)s)',
+)
+parser.add_argument(
+    '--composite-depth', type=int, default=1,
+    help='nesting depth of composite glyphs (default: %(default)s)',
+)
+parser.add_argument(
+    '--components', type=int, default=2,
+    help='components per composite glyph (default: %(default)s)',
+)
+parser.add_argument(
+    '--ttc-fonts', type=int, default=4,
+    help='member fonts of the TTC (default: %(default)s)',
+)
+parser.add_argument(
+    '--unshared', action='store_true', default=False,
+    help='give each TTC member its own copy of the tables',
+)
+parser.add_argument(
+    '--seed', type=int, default=0,
+    help='seed of the random outlines (default: %(default)s)',
+)
+parser.add_argument(
+    '-r', '--repeat', type=int, default=3,
+    help='runs per scenario; the best time is reported '
+         '(default: %(default)s)',
+)
+parser.add_argument(
+    '-s', '--scenario', action='append', default=None,
+    choices=[name for name, scenario, kind in scenarios.SCENARIOS],
+    help='scenario to run; may be repeated (default: all)',
+)
+parser.add_argument(
+    '-o', '--output', default=None,
+    help='file to write the JSON results to (default: stdout)',
+)
+
+
+def main():
+    namespace = parser.parse_args()
+    spec = fontgen.FontSpec(
+        num_glyphs=namespace.glyphs,
+        contours=namespace.contours,
+        points=namespace.points,
+        off_curve=namespace.off_curve,
+        composite_ratio=namespace.composite_ratio,
+        composite_depth=namespace.composite_depth,
+        components=namespace.components,
+        seed=namespace.seed,
+    )
+
+    tmpdir = tempfile.mkdtemp(prefix='ttfc-bench-')
+    try:
+        paths = {
+            'ttf': os.path.join(tmpdir, 'synthetic.ttf'),
+            'ttc': os.path.join(tmpdir, 'synthetic.ttc'),
+        }
+        with open(paths['ttf'], 'wb') as fout:
+            fout.write(fontgen.build_ttf(spec))
+        with open(paths['ttc'], 'wb') as fout:
+            fout.write(fontgen.build_ttc(
+                spec, namespace.ttc_fonts, shared=not namespace.unshared,
+            ))
+
+        results = []
+        for name, scenario, kind in scenarios.SCENARIOS:
+            if namespace.scenario and name not in namespace.scenario:
+                continue
+            result = scenarios.run(
+                name, scenario, paths[kind], repeat=namespace.repeat,
+            )
+            results.append(result)
+            sys.stderr.write(
+                '{scenario:<14} {glyphs:>7} glyphs {seconds:>9.4f} s '
+                '{glyphs_per_sec:>12.1f} glyphs/s '
+                '{peak_rss_kb:>9} KB peak\n'.format(**result)
+            )
+
+        report = {
+            'python': sys.version.split()[0],
+            'spec': spec.as_dict(),
+            'ttc_fonts': namespace.ttc_fonts,
+            'shared': not namespace.unshared,
+            'font_bytes': os.path.getsize(paths['ttf']),
+            'results': results,
+        }
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if namespace.output is None:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(namespace.output, 'w') as fout:
+            json.dump(report, fout, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+import random
+import struct
+
+
+# Builds synthetic but valid TrueType fonts and collections in memory.
+# Reference:
+# https://developer.apple.com/fonts/TrueType-Reference-Manual/
+
+FIRST_CODEPOINT = 0x4e00
+# simple glyphs stay within the bounding box of the head table
+COORDINATE_LIMIT = 2000
+
+
+class FontSpec(object):
+    'parameters of a synthetic font.\n'
+    '  num_glyphs         - number of glyphs, including .notdef\n'
+    '  contours           - contours per simple glyph\n'
+    '  points             - points per contour\n'
+    '  off_curve          - ratio of off-curve points\n'
+    '  composite_ratio    - ratio of glyphs that are composites\n'
+    '  composite_depth    - nesting depth of composite glyphs\n'
+    '  components         - components per composite glyph\n'
+    '  seed               - seed of the random outlines'
+    def __init__(
+            self,
+            num_glyphs=1000,
+            contours=3,
+            points=24,
+            off_curve=0.5,
+            composite_ratio=0.2,
+            composite_depth=1,
+            components=2,
+            seed=0,
+    ):
+        self.num_glyphs = num_glyphs
+        self.contours = contours
+        self.points = points
+        self.off_curve = off_curve
+        self.composite_ratio = composite_ratio
+        self.composite_depth = composite_depth
+        self.components = components
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def build_ttf(spec, name='Synthetic'):
+    'returns the bytes of a TTF file built from spec.'
+    tables = build_tables(spec, name)
+    return pack_font(tables)
+
+def build_ttc(spec, num_fonts=2, shared=True):
+    'returns the bytes of a TTC file with num_fonts members built from\n'
+    'spec.  with shared, the members point at the same tables except\n'
+    'name; otherwise each member has its own copy of every table.'
+    members = []
+    for i in range(num_fonts):
+        members.append(build_tables(spec, 'Synthetic{}'.format(i)))
+
+    header_length = 0xc + 4 * num_fonts
+    directory_lengths = [0xc + 0x10 * len(tables) for tables in members]
+    position = header_length + sum(directory_lengths)
+
+    data = []
+    placed = {}
+    directories = []
+    for tables in members:
+        entries = []
+        for tag in sorted(tables):
+            body = tables[tag]
+            key = (tag, body) if shared else (tag, body, len(directories))
+            if key not in placed:
+                placed[key] = position
+                data.append(pad(body))
+                position += len(pad(body))
+            entries.append((tag, checksum(body), placed[key], len(body)))
+        directories.append(table_directory(entries))
+
+    offsets = []
+    position = header_length
+    for directory in directories:
+        offsets.append(position)
+        position += len(directory)
+
+    return ''.join(
+        [struct.pack('>4sHHI', 'ttcf', 1, 0, num_fonts)]
+        + [struct.pack('>I', offset) for offset in offsets]
+        + directories
+        + data
+    )
+
+
+def pack_font(tables):
+    directory_length = 0xc + 0x10 * len(tables)
+    position = directory_length
+    entries = []
+    data = []
+    for tag in sorted(tables):
+        body = tables[tag]
+        entries.append((tag, checksum(body), position, len(body)))
+        data.append(pad(body))
+        position += len(pad(body))
+
+    return table_directory(entries) + ''.join(data)
+
+def table_directory(entries):
+    num_tables = len(entries)
+    entry_selector = max(
+        i for i in range(16) if 2**i <= max(num_tables, 1)
+    )
+    search_range = 16 * 2**entry_selector
+    return ''.join(
+        [struct.pack(
+            '>I4H',
+            0x00010000,
+            num_tables,
+            search_range,
+            entry_selector,
+            num_tables * 16 - search_range,
+        )]
+        + [struct.pack('>4s3I', *entry) for entry in entries]
+    )
+
+def pad(data):
+    return data + '\x00' * (-len(data) % 4)
+
+def checksum(data):
+    data = pad(data)
+    return sum(
+        struct.unpack('>{}I'.format(len(data) // 4), data)
+    ) & 0xffffffff
+
+
+def build_tables(spec, name):
+    rnd = random.Random(spec.seed)
+    glyphs = build_glyphs(spec, rnd)
+
+    glyf = ''.join(glyphs)
+    offsets = [0]
+    for glyph in glyphs:
+        offsets.append(offsets[-1] + len(glyph))
+
+    return {
+        'head': head_table(),
+        'hhea': hhea_table(spec.num_glyphs),
+        'maxp': maxp_table(spec),
+        'name': name_table(name),
+        'OS/2': os_2_table(),
+        'post': post_table(spec.num_glyphs),
+        'cmap': cmap_table(spec.num_glyphs),
+        'hmtx': hmtx_table(spec.num_glyphs),
+        'loca': struct.pack('>{}I'.format(len(offsets)), *offsets),
+        'glyf': glyf,
+    }
+
+def build_glyphs(spec, rnd):
+    'glyph 0 is .notdef (a simple glyph), glyph 1 is empty; the remaining\n'
+    'ones are simple or, in the given ratio, composite glyphs whose\n'
+    'components are glyphs of the level below.  the first composites go\n'
+    'one level deeper each, so that the given depth is reached.'
+    glyphs = [simple_glyph(spec, rnd), '']
+    levels = [[0]]  # glyph indices by composite nesting level
+    count = 0
+    if spec.composite_depth:
+        count = int(round(spec.composite_ratio * (spec.num_glyphs - 2)))
+    composites = set(rnd.sample(range(2, spec.num_glyphs), count))
+    for index in range(2, spec.num_glyphs):
+        level = 0
+        if index in composites:
+            if len(levels) <= spec.composite_depth:
+                level = len(levels)
+            else:
+                level = rnd.randint(1, spec.composite_depth)
+
+        if level:
+            components = [
+                rnd.choice(levels[level-1]) for i in range(spec.components)
+            ]
+            glyphs.append(composite_glyph(components, rnd))
+        else:
+            glyphs.append(simple_glyph(spec, rnd))
+
+        if len(levels) <= level:
+            levels.append([])
+        levels[level].append(index)
+
+    assert sum(len(level) for level in levels[1:]) == count
+    assert len(levels) - 1 == min(spec.composite_depth, count)
+    return glyphs
+
+def simple_glyph(spec, rnd):
+    flags = []
+    xs = []
+    ys = []
+    end_pts = []
+    x, y = 0, 0
+    for contour in range(spec.contours):
+        for point in range(spec.points):
+            on_curve = point == 0 or rnd.random() >= spec.off_curve
+            flags.append(0x01 if on_curve else 0x00)
+            x_next, y_next = random_step(x, rnd), random_step(y, rnd)
+            xs.append(x_next - x)
+            ys.append(y_next - y)
+            x, y = x_next, y_next
+        end_pts.append(len(flags) - 1)
+
+    x_data, y_data = [], []
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        flags[i] |= coordinate_flag(x, x_data, 0x02, 0x10)
+        flags[i] |= coordinate_flag(y, y_data, 0x04, 0x20)
+
+    xs_abs = running_sum(xs)
+    ys_abs = running_sum(ys)
+    bbox = (min(xs_abs), min(ys_abs), max(xs_abs), max(ys_abs))
+
+    return pad(''.join(
+        [struct.pack('>5h', len(end_pts), *bbox)]
+        + [struct.pack('>{}H'.format(len(end_pts)), *end_pts)]
+        + [struct.pack('>H', 0)]  # no instructions
+        + [pack_flags(flags)]
+        + x_data
+        + y_data
+    ))
+
+def random_step(position, rnd):
+    'the next coordinate after position: mostly short deltas, some long\n'
+    'ones and some zeros, kept within COORDINATE_LIMIT so that any number\n'
+    'of points fits the bounding box.'
+    delta = rnd.choice([0, rnd.randint(-255, 255), rnd.randint(-1000, 1000)])
+    return max(-COORDINATE_LIMIT, min(position + delta, COORDINATE_LIMIT))
+
+def coordinate_flag(delta, data, short, same):
+    if delta == 0:
+        return same
+    if -255 <= delta <= 255:
+        data.append(struct.pack('>B', abs(delta)))
+        return short | (same if delta > 0 else 0)
+    data.append(struct.pack('>h', delta))
+    return 0
+
+def pack_flags(flags):
+    packed = []
+    i = 0
+    while i < len(flags):
+        run = 1
+        while i + run < len(flags) and flags[i+run] == flags[i] and run < 256:
+            run += 1
+        if run > 1:
+            packed.append(struct.pack('>2B', flags[i] | 0x08, run - 1))
+        else:
+            packed.append(struct.pack('>B', flags[i]))
+        i += run
+
+    return ''.join(packed)
+
+def composite_glyph(components, rnd):
+    data = [struct.pack('>5h', -1, 0, 0, 1000, 1000)]
+    for i, component in enumerate(components):
+        flag = 0x0001 | 0x0002  # words, xy values
+        if i < len(components) - 1:
+            flag |= 0x0020  # more components
+        scale = rnd.random() < 0.3
+        if scale:
+            flag |= 0x0008
+        data.append(struct.pack(
+            '>2H2h', flag, component,
+            rnd.randint(-200, 200), rnd.randint(-200, 200),
+        ))
+        if scale:
+            data.append(struct.pack('>h', rnd.randint(8192, 16384)))
+
+    return pad(''.join(data))
+
+def running_sum(values):
+    sums = []
+    total = 0
+    for value in values:
+        total += value
+        sums.append(total)
+    return sums or [0]
+
+
+def head_table():
+    return struct.pack(
+        '>2I2I2H2q4h2H3h',
+        0x00010000, 0x00010000,     # version, font revision
+        0, 0x5f0f3cf5,              # checksum adjustment, magic number
+        0, 1000,                    # flags, units per em
+        3786825600, 3786825600,     # created, modified (2024-01-01)
+        -2000, -2000, 2000, 2000,   # bounding box
+        0, 8,                       # mac style, lowest rec ppem
+        2, 1, 0,                    # direction hint, long loca, glyph format
+    )
+
+def hhea_table(num_glyphs):
+    return struct.pack(
+        '>I3hH6h4hhH',
+        0x00010000,
+        800, -200, 0, 1000, 0, 0, 1000, 1, 0, 0,
+        0, 0, 0, 0,
+        0, num_glyphs,
+    )
+
+def maxp_table(spec):
+    return struct.pack(
+        '>I14H',
+        0x00010000,
+        spec.num_glyphs,
+        spec.contours * spec.points, spec.contours,
+        spec.contours * spec.points * spec.components ** spec.composite_depth,
+        spec.contours * spec.components ** spec.composite_depth,
+        2, 0, 0, 0, 0, 0, 0,
+        spec.components, spec.composite_depth,
+    )
+
+def name_table(name):
+    records = [(1, 0, 0, 1, name), (1, 0, 0, 4, name), (1, 0, 0, 6, name)]
+    strings = ''
+    entries = []
+    for platform, specific, language, name_id, string in records:
+        entries.append(struct.pack(
+            '>6H', platform, specific, language, name_id,
+            len(string), len(strings),
+        ))
+        strings += string
+
+    return ''.join(
+        [struct.pack('>3H', 0, len(records), 6 + 12 * len(records))]
+        + entries
+        + [strings]
+    )
+
+def os_2_table():
+    return (
+        struct.pack('>Hh2H12h', 4, 500, 400, 5, *([0] * 12))
+        + '\x00' * 10               # panose
+        + struct.pack('>4I', 0, 0, 0, 0)
+        + 'NONE'
+        + struct.pack('>3H3h2H', 0x40, 0x20, 0xffff, 800, -200, 0, 1000, 200)
+        + struct.pack('>2I', 1, 0)
+        + struct.pack('>2h3H', 500, 700, 0, 32, 1)
+    )
+
+def post_table(num_glyphs):
+    names = ['glyph{:05d}'.format(i) for i in range(num_glyphs - 1)]
+    return ''.join(
+        [struct.pack('>2I2h5IH', 0x00020000, 0, -100, 50, 0, 0, 0, 0, 0,
+                     num_glyphs)]
+        + [struct.pack('>H', 0)]    # .notdef
+        + [struct.pack('>H', 258 + i) for i in range(num_glyphs - 1)]
+        + [chr(len(name)) + name for name in names]
+    )
+
+def cmap_table(num_glyphs):
+    'maps FIRST_CODEPOINT.. to glyphs 1.. through a format 4 subtable\n'
+    '(BMP part only) and a format 12 subtable.'
+    last = FIRST_CODEPOINT + num_glyphs - 2
+    bmp_last = min(last, 0xfffe)
+    delta = (1 - FIRST_CODEPOINT) & 0xffff
+    format_4 = ''.join([
+        struct.pack('>7H', 4, 16 + 8 * 2, 0, 4, 4, 1, 0),
+        struct.pack('>2H', bmp_last, 0xffff),       # end codes
+        struct.pack('>H', 0),                       # reserved pad
+        struct.pack('>2H', FIRST_CODEPOINT, 0xffff),  # start codes
+        struct.pack('>2H', delta, 1),               # id deltas
+        struct.pack('>2H', 0, 0),                   # id range offsets
+    ])
+    format_12 = struct.pack(
+        '>2H3I3I', 12, 0, 28, 0, 1, FIRST_CODEPOINT, last, 1,
+    )
+
+    header_length = 4 + 8 * 2
+    return ''.join([
+        struct.pack('>2H', 0, 2),
+        struct.pack('>2HI', 3, 1, header_length),
+        struct.pack('>2HI', 3, 10, header_length + len(format_4)),
+        format_4,
+        format_12,
+    ])
+
+def hmtx_table(num_glyphs):
+    return struct.pack('>{}H'.format(2 * num_glyphs), *([1000, 0] * num_glyphs))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import ttfutil
+
+
+# Each scenario takes the path of a font file and returns the number of
+# glyphs it processed; it is timed in a fresh process, so that the peak
+# memory reported is its own.
+
+def construct(path):
+    with open(path, 'rb') as fin:
+        ttf = ttfutil.TTFObject(fin)
+        ttf.parse_tables()
+        return ttf.maxp.num_glyphs
+
+def construct_ttc(path):
+    with open(path, 'rb') as fin:
+        ttc = ttfutil.TTCObject(fin)
+        for ttf in ttc.ttfs:
+            ttf.parse_tables()
+        return sum(ttf.maxp.num_glyphs for ttf in ttc.ttfs)
+
+def decode(path):
+    with open(path, 'rb') as fin:
+        ttf = ttfutil.TTFObject(fin, glyph_cache_size=0)
+        for glyph in ttf.glyf.glyphs:
+            pass
+        return len(ttf.glyf.glyphs)
+
+def draw_line(path):
+    with open(path, 'rb') as fin:
+        ttf = ttfutil.TTFObject(fin)
+        for index in range(ttf.maxp.num_glyphs):
+            ttf.glyf.draw_line(index, scale=0.1)
+        return ttf.maxp.num_glyphs
+
+def calc_path(path):
+    with open(path, 'rb') as fin:
+        ttf = ttfutil.TTFObject(fin)
+        contours = []
+        for index in range(ttf.maxp.num_glyphs):
+            for outline in ttf.glyf.outline(index):
+                contours.extend(outline)
+
+    matrix = [[1.0, 0.0], [0.0, 1.0]]
+    start = time.time()
+    for flags, points in contours:
+        ttfutil.calc_path(flags, points, matrix)
+    return ttf.maxp.num_glyphs, time.time() - start
+
+def save(path):
+    outdir = tempfile.mkdtemp(prefix='ttfc-bench-')
+    try:
+        with open(path, 'rb') as fin:
+            ttf = ttfutil.TTFObject(fin)
+            export = ttf.export(os.path.join(outdir, '{index}.svg'), 0.1)
+            for index in range(ttf.maxp.num_glyphs):
+                export.save(index)
+            return ttf.maxp.num_glyphs
+    finally:
+        shutil.rmtree(outdir)
+
+SCENARIOS = [
+    ('construct', construct, 'ttf'),
+    ('construct_ttc', construct_ttc, 'ttc'),
+    ('decode', decode, 'ttf'),
+    ('draw_line', draw_line, 'ttf'),
+    ('calc_path', calc_path, 'ttf'),
+    ('save', save, 'ttf'),
+]
+
+
+def run(name, scenario, path, repeat=3):
+    'runs scenario repeat times, each in a new process, and returns the\n'
+    'best time along with the largest peak memory.'
+    results = []
+    for i in range(repeat):
+        parent, child = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=_measure, args=(scenario, path, child),
+        )
+        process.start()
+        result = parent.recv()
+        process.join()
+        if isinstance(result, Exception):
+            raise result
+        results.append(result)
+
+    glyphs, seconds = min(results, key=lambda r: r[1])[:2]
+    return {
+        'scenario': name,
+        'glyphs': glyphs,
+        'seconds': seconds,
+        'glyphs_per_sec': glyphs / seconds if seconds else None,
+        'peak_rss_kb': max(r[2] for r in results),
+        'start_rss_kb': min(r[3] for r in results),
+        'repeat': repeat,
+    }
+
+def _measure(scenario, path, pipe):
+    try:
+        start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        glyphs = scenario(path)
+        seconds = time.time() - start
+        if isinstance(glyphs, tuple):  # the scenario timed itself
+            glyphs, seconds = glyphs
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        pipe.send((glyphs, seconds, peak_rss, start_rss))
+    except Exception as e:
+        pipe.send(e)
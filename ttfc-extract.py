@@ -1,23 +1,35 @@
 #!/usr/bin/env python
 
 import argparse
+import itertools
+import json
+import multiprocessing
 import os
 import sys
+import time
 import ttfutil
+from array import array
+from collections import OrderedDict
 
 _version = '0.2'
 
 
 usage = (
-    'ttfc-extract [options] <file>\n'
+    'ttfc-extract [options] <file>...\n'
     "`ttfc-extract -h' for help message."
 )
-help_ = '''usage: ttfc-extract [options] <file>
+help_ = '''usage: ttfc-extract [options] <file>...
 
 Extract font glyphs from TTF/TTC files in SVG format.
 
 argument:
-    <file>      either a TTF or a TTC file
+    <file>      either a TTF or a TTC file, or a directory of them.  With
+                several files or a directory, the glyphs of all the fonts
+                are saved in one run, sharing the workers of -j, and the
+                glyphs saved and the time taken for each font are
+                reported on stderr.  A file that cannot be read is
+                reported as `Failed:' and the other ones are saved.  Only
+                one file is open at a time.
 
 options:
     -h, --help    shows this message
@@ -27,12 +39,30 @@ options:
 
     -q            be silent on success
 
+    --list        lists the fonts instead, a line each: the file and index
+                of the font, the number of glyphs and the PostScript name.
+                Only the table directory and the head, maxp, name and post
+                tables are read, so this is quick even for large files.
+
+    --info        like --list, but prints a line of JSON for each font, with
+                its names, revision, units per em, number of glyphs, table
+                directory and glyph names.
+
     -g index      extracts only index-th glyph.  Specify negative number to
                 extract all glyphs.  Note that 0-th index means first glyph.
-                Defaults to -1.
+                Also takes ranges and comma separated lists, like `10-20,42',
+                or `@file' to read such a list from file.  Ranges past the
+                last glyph stop at it.  Glyphs are read in the order they
+                are stored in the font.  Defaults to -1.
 
     -f index      extracts only index-th fonts (with TTC only); like -g.
 
+    -u codepoints
+                  extracts only the glyphs mapped from the given Unicode
+                codepoints, looked up in the cmap table.  Takes a comma
+                separated list of hexadecimal codepoints or ranges, like
+                `41-5a,U+3042,0x4e00-0x9fff'.  Overrides -g.
+
     -s scale      scales the vectors.  Defaults to 0.10.
 
     -o name       specifies the name of output file.  You can use the following
@@ -40,6 +70,11 @@ options:
 
                     {{gname}}: name of the glyph
                     {{fname}}: name of the font
+                    {{file}}: name of the font file, without the extension
+                    {{path}}: path of the font file, without the extension,
+                              relative to the directory of the given files
+                              (the directory itself, if one is given)
+                    {{font}}: index of the font in its file (0 unless a TTC)
                     {{index}}: index
 
                 Note that you can use python-style format, like:
@@ -48,7 +83,77 @@ options:
                     {{index:0>4}}
 
                 To use either `{{' or `}}', you have to escape them as `{{{{'
-                and `}}}}', respectively.  Defaults to `{{index}}.svg'.
+                and `}}}}', respectively.  Defaults to `{{index}}.svg', or
+                `{{path}}/{{font}}/{{index}}.svg' with several fonts or a
+                directory.  With several fonts, the name has to tell the
+                glyphs of different fonts apart.
+
+    -p digits, --precision digits
+                  rounds the coordinates to the given number of digits after
+                the decimal point.  Defaults to as many as needed.
+
+    --compact     writes the paths with relative commands and without the
+                indentation and newlines, for smaller files.
+
+    -j jobs       saves glyphs with the given number of worker processes.
+                Each worker opens the fonts by itself.  The glyphs are
+                handed out in chunks of about the same estimated cost,
+                smaller towards the end.  Defaults to 1.
+
+    -w threads    writes the glyphs from the given number of threads in the
+                background while the next glyphs are rendered (with -j 1).
+                At most 64 glyphs wait to be written at a time.  Only one
+                thread writes to an archive.  Defaults to 0, writing each
+                glyph before rendering the next.
+
+    -a archive    writes all glyphs into a single archive instead of one file
+                per glyph.  Member names follow -o.  The format follows the
+                extension: .zip, .tar, .tar.gz, .tgz or .tar.bz2.
+
+    -z            compresses each member of a zip archive (with -a).
+
+    -m manifest   records the saved glyphs in the given manifest file, along
+                with the table checksums and font revision of the font, the
+                scale and the output name.  Glyphs recorded by an earlier
+                run with the same inputs whose files still exist are
+                skipped, so an interrupted run resumes where it stopped.
+
+    -c dir        caches the parsed glyph names (post) and cmap tables of
+                large fonts in the given directory, so that later runs on
+                the same font load them instead of parsing them again.
+
+    -r atlas      renders the glyphs into bitmaps of --pixels pixels square
+                instead, packed into a single grayscale image, .pgm or .png.
+                The position, index and name of each glyph go into a JSON
+                index next to it, named after the image.  Needs NumPy.
+
+    --pixels size
+                  size of each glyph in the atlas (with -r).  Defaults to 32.
+
+    --metrics file
+                  writes the advance width, left side bearing, number of
+                contours and bounding box of each glyph into a single file
+                instead, read without decoding the outlines.  A .csv file
+                gets a line per glyph; a .bin file gets each column as an
+                array of little-endian 16-bit integers, with a JSON index
+                next to it, named after the file.
+
+    --dedup method
+                  renders and writes the glyphs whose records in the font are
+                byte-identical only once.  The duplicates become hard links
+                (`link') or symbolic links (`symlink') to the first of them,
+                or are listed in the --aliases file instead (`alias').
+                Only `alias' can be used with -a.
+
+    --aliases file
+                  the JSON file mapping the output name of each duplicate
+                to that of the glyph it duplicates (with --dedup alias).
+                Defaults to `aliases.json'.
+
+    --stats       reports the time taken by each table parser, the time
+                taken to decode, render and write the glyphs, the bytes
+                written, the throughput and the slowest glyphs on stderr,
+                as a summary followed by a line of JSON.
 
 original-maintainer:
     https://github.com/rsk0315
@@ -56,6 +161,93 @@ original-maintainer:
 '''
 
 
+def parse_ranges(string, parse):
+    'parses "a,b-c,..." into [(a, a), (b, c), ...] with parse for each bound.'
+    ranges = []
+    for item in string.split(','):
+        if not item.strip():
+            continue
+        bounds = item.split('-')
+        if len(bounds) > 2:
+            raise argparse.ArgumentTypeError(
+                'invalid range: {!r}'.format(item)
+            )
+        try:
+            bounds = [parse(b.strip()) for b in bounds]
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                'invalid range: {!r}'.format(item)
+            )
+        if bounds[0] > bounds[-1]:
+            raise argparse.ArgumentTypeError(
+                'reversed range: {!r}'.format(item)
+            )
+        ranges.append((bounds[0], bounds[-1]))
+
+    return ranges
+
+def font_paths(paths):
+    'expands the directories among paths into the TTF and TTC files in\n'
+    'them and in their subdirectories, in sorted order.'
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(('.ttf', '.ttc')):
+                    files.append(os.path.join(dirpath, filename))
+
+    return files
+
+def relative_paths(paths, files):
+    'maps each of files to its path without the extension, relative to\n'
+    'the directory all of paths are in (a directory among paths counts\n'
+    'as being in itself).'
+    dirs = [
+        os.path.abspath(path if os.path.isdir(path) else os.path.dirname(path))
+        for path in paths
+    ]
+    # compared a directory at a time, so that /a/b is not under /a/bc
+    base = os.sep.join(
+        os.path.commonprefix([dirname.split(os.sep) for dirname in dirs])
+    ) or os.sep
+    return dict(
+        (filename, os.path.splitext(
+            os.path.relpath(os.path.abspath(filename), base)
+        )[0])
+        for filename in files
+    )
+
+def codepoint_ranges(string):
+    'parses "41,61-7a,U+3042-U+3093" into [(0x41, 0x41), (0x61, 0x7a), ...].'
+    return parse_ranges(
+        string,
+        lambda b: int(b.upper().replace('U+', '').replace('0X', ''), 16),
+    )
+
+def glyph_ranges(string):
+    'parses "5", "1,5,10-20" or "@file" into [(1, 1), (5, 5), (10, 20)];\n'
+    'a negative number (all glyphs) gives None.'
+    if string.startswith('@'):
+        try:
+            with open(string[1:]) as fin:
+                string = ','.join(fin.read().split())
+        except IOError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
+    try:
+        if int(string) < 0:
+            return None
+    except ValueError:
+        pass
+
+    return parse_ranges(string, int)
+
+
 parser = argparse.ArgumentParser(
     add_help=False,
     usage=usage,
@@ -71,16 +263,68 @@ parser.add_argument(
     '-q', action='store_true', default=False,
 )
 parser.add_argument(
-    '-g', metavar='INDEX', type=int, default=-1,
+    '--list', action='store_true', default=False,
+)
+parser.add_argument(
+    '--info', action='store_true', default=False,
+)
+parser.add_argument(
+    '-g', metavar='INDEX', type=glyph_ranges, default=None,
 )
 parser.add_argument(
     '-f', metavar='INDEX', type=int, default=-1,
 )
+parser.add_argument(
+    '-u', metavar='CODEPOINTS', type=codepoint_ranges, default=None,
+)
 parser.add_argument(
     '-s', metavar='SCALE', type=float, default=0.10,
 )
 parser.add_argument(
-    '-o', metavar='name', default='{index}.svg',
+    '-o', metavar='name', default=None,
+)
+parser.add_argument(
+    '-p', '--precision', metavar='DIGITS', type=int, default=None,
+)
+parser.add_argument(
+    '--compact', action='store_true', default=False,
+)
+parser.add_argument(
+    '-j', metavar='JOBS', type=int, default=1,
+)
+parser.add_argument(
+    '-w', metavar='THREADS', type=int, default=0,
+)
+parser.add_argument(
+    '-a', metavar='ARCHIVE', default=None,
+)
+parser.add_argument(
+    '-z', action='store_true', default=False,
+)
+parser.add_argument(
+    '-m', metavar='MANIFEST', default=None,
+)
+parser.add_argument(
+    '-c', metavar='DIR', default=None,
+)
+parser.add_argument(
+    '-r', metavar='ATLAS', default=None,
+)
+parser.add_argument(
+    '--pixels', metavar='SIZE', type=int, default=32,
+)
+parser.add_argument(
+    '--metrics', metavar='FILE', default=None,
+)
+parser.add_argument(
+    '--dedup', metavar='METHOD', choices=('link', 'symlink', 'alias'),
+    default=None,
+)
+parser.add_argument(
+    '--aliases', metavar='FILE', default='aliases.json',
+)
+parser.add_argument(
+    '--stats', action='store_true', default=False,
 )
 
 parser.add_argument(
@@ -100,73 +344,653 @@ def main():
         ).format(_version)
         return 0
 
-    if not len(namespace.file) == 1:
+    if not namespace.file:
         print usage
         return 1
 
-    with open(namespace.file[0], 'rb') as fin:
-        magic = fin.read(4)
-
-        if magic in ('true', '\x00\x01\x00\x00'):
-            try:
-                ttf = ttfutil.TTFObject(fin)
-            except Exception as e:
-                print e
-                print 'Unexpected error occurred while reading the TTF file.'
-                return 2
-
-            ttfs = (ttf,)
-
-        elif magic in ('ttcf',):
-            try:
-                ttc = ttfutil.TTCObject(fin)
-            except Exception as e:
-                print e
-                print 'Unexpected error occurred while reading the TTC file.'
-                return 2
-
-            ttfs = ttc.ttfs
-            if namespace.f > -1:
-                if namespace.f < len(ttfs):
-                    ttfs = (ttfs[namespace.f],)
-                else:
-                    ttfs = ()
-
-        elif magic in ('typ1', 'OTTO'):
-            print 'This program cannot handle the font format.\n'
-            print 'Magic: {!r} {!r} {!r} {!r}'.format(*magic)
-            return 2
+    paths = font_paths(namespace.file)
+    if not paths:
+        print 'No TTF/TTC files found.'
+        return 1
 
-        else:
-            print 'This file is written in unexpected format.\n'
-            print 'Magic: {!r} {!r} {!r} {!r}'.format(*magic)
-            return 2
+    # several files, or a directory of them
+    batch = len(paths) > 1 or os.path.isdir(namespace.file[0])
+
+    if namespace.m is not None and namespace.a is not None:
+        print '-m cannot be used with -a.'
+        return 1
 
+    if namespace.r is not None:
+        if namespace.a is not None or namespace.m is not None:
+            print '-r cannot be used with -a or -m.'
+            return 1
+        if ttfutil.numpy is None:
+            print '-r needs NumPy.'
+            return 1
+        if not namespace.r.endswith(('.pgm', '.png')):
+            print '-r takes either a .pgm or a .png file.'
+            return 1
+
+    if namespace.metrics is not None:
+        if (
+            namespace.a is not None or namespace.m is not None
+            or namespace.r is not None or namespace.dedup is not None
+        ):
+            print '--metrics cannot be used with -a, -m, -r or --dedup.'
+            return 1
+        if not namespace.metrics.endswith(('.csv', '.bin')):
+            print '--metrics takes either a .csv or a .bin file.'
+            return 1
+
+    if namespace.dedup is not None:
+        if namespace.r is not None:
+            print '--dedup cannot be used with -r.'
+            return 1
+        if namespace.a is not None and not namespace.dedup == 'alias':
+            print '--dedup {} cannot be used with -a.'.format(namespace.dedup)
+            return 1
+
+    start = time.time()
+    stats = None
+    if namespace.stats:
+        stats = ttfutil.TTFStats()
 
     options = {
-        'outname': namespace.o,
         'scale': namespace.s,
+        'precision': namespace.precision,
+        'compact': namespace.compact,
     }
+    relative = relative_paths(namespace.file, paths)
+    manifest = None
+    if namespace.m is not None:
+        # skip the glyphs done by an earlier run with the same inputs
+        manifest = ttfutil.TTFManifest(namespace.m)
+
+    # the files are read one at a time for the glyphs to save, and each
+    # is closed before the next is opened; the glyphs are saved once all
+    # of them have been read, so that a wrong -o is found before anything
+    # is saved.  only the last file stays open meanwhile.
+    sources = []
+    files = ttfutil.FontFiles(sources, namespace.c, stats)
+    failed = []
+    tasks = []
+    duplicates = []
+    # estimated cost of each task, for -j
+    costs = []
+    keys = {}
+    owners = {}
+    try:
+        for path in paths:
+            fin = open(path, 'rb')
+            fonts = _open_fonts(fin, namespace, stats)
+            if fonts is None:
+                fin.close()
+                if not batch:
+                    return 2
+                # the other fonts are saved all the same
+                print 'Failed:', path
+                failed.append(path)
+                continue
+
+            files.reuse(path, fonts)
+            ttfs = []
+            for index, ttf_ in fonts:
+                ttfs.append((len(sources), ttf_))
+                sources.append((path, index))
+
+            if namespace.list or namespace.info:
+                for k, ttf_ in ttfs:
+                    path, index = sources[k]
+                    if namespace.info:
+                        print json.dumps(_font_info(path, index, ttf_))
+                    else:
+                        print u'{}#{}\t{}\t{}'.format(
+                            path, index, ttf_.maxp.num_glyphs,
+                            ttf_.name.find_text(6) or u'',
+                        ).encode('utf-8')
+                continue
+
+            if namespace.o is None:
+                namespace.o = '{index}.svg'
+                if batch or len(fonts) > 1:
+                    namespace.o = '{path}/{font}/{index}.svg'
+
+            font_options = dict(
+                options, outname=namespace.o, path=relative[path],
+            )
+            file_tasks = []
+            for k, ttf_ in ttfs:
+                # in glyf table order, so that the glyphs are read
+                # sequentially
+                for i in ttf_.glyf.glyphs.sort_by_offset(
+                    _glyph_indices(ttf_, namespace)
+                ):
+                    file_tasks.append((k, i, font_options))
+
+            file_duplicates = []
+            if namespace.r is None and namespace.metrics is None:
+                if batch or len(fonts) > 1:
+                    name = _shared_outname(ttfs, file_tasks, owners)
+                    if name is not None:
+                        print (
+                            '-o gives {} to glyphs of different fonts.'
+                        ).format(name)
+                        print 'Use {path} and {font} to tell the fonts apart.'
+                        return 1
+
+                if namespace.dedup is not None:
+                    # render only the first of the glyphs with identical
+                    # records; found before the manifest skips any, so that
+                    # the same glyphs are the duplicates on every run
+                    file_tasks, file_duplicates = _find_duplicates(
+                        ttfs, file_tasks,
+                    )
+
+                if manifest is not None:
+                    file_tasks, file_duplicates = _skip_saved(
+                        manifest, ttfs, sources, keys, namespace,
+                        file_tasks, file_duplicates,
+                    )
+
+                if namespace.j > 1:
+                    costs.extend(_task_costs(ttfs, file_tasks))
+
+            tasks.extend(file_tasks)
+            duplicates.extend(file_duplicates)
+
+        if namespace.list or namespace.info:
+            return 2 if failed else 0
+
+        if namespace.r is not None:
+            atlas = ttfutil.GlyphAtlas(
+                namespace.r, len(tasks), namespace.pixels,
+            )
+            _add_to_atlas(files, tasks, atlas)
+            atlas.save()
+            if not namespace.q:
+                print 'Saved:', namespace.r
+            if stats is not None:
+                stats.report(sys.stderr)
+            return 2 if failed else 0
 
-    for ttf_ in ttfs:
-        if namespace.g < 0:
-            start = 0
-            end = ttf_.maxp.num_glyphs
+        if namespace.metrics is not None:
+            _save_metrics(files, tasks, namespace.metrics)
+            if not namespace.q:
+                print 'Saved:', namespace.metrics
+            if stats is not None:
+                stats.report(sys.stderr)
+            return 2 if failed else 0
+
+        archive = None
+        if namespace.a is not None:
+            archive = ttfutil.SVGArchive(namespace.a, compress=namespace.z)
+
+        # glyphs saved and seconds taken for each font; with -j, the
+        # seconds are those taken by the workers
+        throughput = dict((k, [0, 0.0]) for k in range(len(sources)))
+        pool = None
+        if namespace.j > 1 and len(tasks) > 1:
+            # each worker opens the fonts by itself; results come back in
+            # the order of the tasks, so the output is the same as with -j 1
+            pool = multiprocessing.Pool(
+                namespace.j,
+                initializer=_init_worker,
+                initargs=(sources, namespace.c, stats is not None),
+            )
+            chunks = _schedule(tasks, costs, namespace.j)
+            if archive is None:
+                names = _unchunk(
+                    chunks, pool.imap(_save_chunk, chunks), throughput,
+                )
+                if stats is not None:
+                    names = _add_stats(stats, names)
+            else:
+                names = _add_to_archive(
+                    archive,
+                    _unchunk(
+                        chunks, pool.imap(_render_chunk, chunks), throughput,
+                    ),
+                    stats,
+                )
         else:
-            start = namespace.g
-            end = start + 1
-
-        for i in range(start, end):
-            try:
-                name = ttf_.save(i, **options)
-            except Exception as e:
-                print e
-                print 'Unexpected error occurred while saving SVGs.'
-                raise e
-                return 2
-
+            threads = namespace.w
+            if archive is not None:
+                # the members are added one at a time, in order
+                threads = min(threads, 1)
+            names = _save_sequential(files, tasks, archive, threads)
+
+        try:
+            last = time.time()
+            for (k, i, options_), name in itertools.izip(tasks, names):
+                throughput[k][0] += 1
+                if pool is None:
+                    now = time.time()
+                    throughput[k][1] += now - last
+                    last = now
+                if manifest is not None:
+                    manifest.add(keys[k], i)
+                if not namespace.q:
+                    print 'Saved:', name
+
+            if duplicates:
+                _save_duplicates(
+                    files, duplicates, archive, namespace, manifest, keys,
+                )
+        except Exception as e:
+            if pool is not None:
+                pool.terminate()
+                pool = None
+            print e
+            print 'Unexpected error occurred while saving SVGs.'
+            raise e
+            return 2
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if archive is not None:
+                archive.close()
+            if manifest is not None:
+                manifest.save()
+
+        if stats is not None:
+            stats.report(sys.stderr)
+        if batch:
+            _report_throughput(
+                sources, throughput, time.time() - start, sys.stderr,
+            )
+        if failed:
+            return 2
+    finally:
+        files.close()
+
+
+def _glyph_indices(ttf_, namespace):
+    'the glyphs of the font selected by -u or -g, or else all of them.'
+    if namespace.u is not None:
+        indices = set()
+        if ttf_.cmap.unicode is not None:
+            for first, last in namespace.u:
+                for code, i in ttf_.cmap.unicode.items(first, last):
+                    indices.add(i)
+        return sorted(indices)
+
+    if namespace.g is None:
+        return range(ttf_.maxp.num_glyphs)
+
+    # ranges past the last glyph of the font are cut short
+    indices = set()
+    for first, last in namespace.g:
+        indices.update(range(first, min(last, ttf_.maxp.num_glyphs - 1) + 1))
+    return indices
+
+def _skip_saved(manifest, ttfs, sources, keys, namespace, tasks, duplicates):
+    'leaves out of tasks and duplicates the glyphs of the fonts of ttfs\n'
+    'that the manifest has as done and whose files still exist; keys gets\n'
+    'the manifest key of each font.'
+    fonts = dict(ttfs)
+    done = {}
+    for k, ttf_ in ttfs:
+        path, index = sources[k]
+        keys[k] = '{}#{}'.format(os.path.abspath(path), index)
+        done[k] = manifest.done(
+            keys[k],
+            manifest.fingerprint(
+                ttf_, namespace.o, namespace.s,
+                namespace.precision, namespace.compact,
+            ),
+        )
+
+    def saved(task):
+        k, i, options = task
+        return i in done[k] and os.path.exists(
+            fonts[k].format_outname(i, namespace.o, options['path'])
+        )
+
+    # links are recorded like files; aliases are never recorded, they are
+    # listed again on every run
+    return (
+        [task for task in tasks if not saved(task)],
+        [
+            (task, original) for task, original in duplicates
+            if not saved(task)
+        ],
+    )
+
+
+def _open_fonts(fin, namespace, stats):
+    'returns [(font index, TTFObject)] of the fonts to save from fin, or\n'
+    'None after telling what is wrong with the file.'
+    magic = fin.read(4)
+    header_only = namespace.list or namespace.info
+    # the tables every run needs, parsed here to report a broken file
+    # before anything is saved; the others are parsed when first used
+    tables = ('head', 'maxp', 'name', 'post')
+    if not header_only:
+        tables += ('loca', 'glyf')
+
+    if magic in ('true', '\x00\x01\x00\x00'):
+        try:
+            ttf = ttfutil.TTFObject(
+                fin, cache_dir=namespace.c, stats=stats,
+                header_only=header_only,
+            )
+            ttf.parse_tables(*tables)
+        except Exception as e:
+            print e
+            print 'Unexpected error occurred while reading the TTF file.'
+            return None
+
+        return [(0, ttf)]
+
+    elif magic in ('ttcf',):
+        try:
+            ttc = ttfutil.TTCObject(
+                fin, cache_dir=namespace.c, stats=stats,
+                header_only=header_only,
+            )
+            for ttf in ttc.ttfs:
+                ttf.parse_tables(*tables)
+        except Exception as e:
+            print e
+            print 'Unexpected error occurred while reading the TTC file.'
+            return None
+
+        ttfs = list(enumerate(ttc.ttfs))
+        if namespace.f > -1:
+            return ttfs[namespace.f:namespace.f+1]
+        return ttfs
+
+    elif magic in ('typ1', 'OTTO'):
+        print 'This program cannot handle the font format.\n'
+        print 'Magic: {!r} {!r} {!r} {!r}'.format(*magic)
+        return None
+
+    else:
+        print 'This file is written in unexpected format.\n'
+        print 'Magic: {!r} {!r} {!r} {!r}'.format(*magic)
+        return None
+
+
+def _font_info(path, index, ttf):
+    'what --info tells about a font, from its header tables only.'
+    return OrderedDict([
+        ('file', path),
+        ('font', index),
+        ('names', OrderedDict(
+            (key, ttf.name.find_text(name_id))
+            for key, name_id in (
+                ('family', 1), ('subfamily', 2), ('full', 4),
+                ('postscript', 6), ('version', 5),
+            )
+        )),
+        ('revision', ttf.head.font_revision),
+        ('units_per_em', ttf.head.units_per_em),
+        ('num_glyphs', ttf.maxp.num_glyphs),
+        ('tables', [
+            OrderedDict([
+                ('tag', tag),
+                ('offset', table.offset),
+                ('length', table.length),
+                ('checksum', table.checksum),
+            ])
+            for tag, table in sorted(ttf.tables.items())
+        ]),
+        # post tables of version 1.0 and 3.0 name no glyphs
+        ('glyph_names', getattr(ttf.post, 'names', None)),
+    ])
+
+
+def _save_sequential(fonts, tasks, archive, threads=0):
+    writer = None
+    if threads > 0:
+        writer = ttfutil.BackgroundWriter(threads)
+
+    try:
+        for k, font_tasks in itertools.groupby(tasks, lambda task: task[0]):
+            font_tasks = list(font_tasks)
+            ttf_ = fonts[k]
+            export = ttf_.export(archive=archive, **font_tasks[0][2])
+            # the glyphs come back in the order of the tasks, i.e. by offset
+            indices = [i for k_, i, options in font_tasks]
+            for i, gname, data in export.iter_svgs(indices):
+                if writer is None:
+                    yield export.write(i, data)
+                    continue
+
+                # the write time goes to the record of this glyph, not the
+                # last one
+                record = -1
+                if ttf_.stats is not None:
+                    record = len(ttf_.stats.glyphs) - 1
+                writer.put(export.write, i, data, record)
+                # only the names of the glyphs written, so that nothing is
+                # taken as saved (e.g. by -m) before it is
+                for name in writer.results():
+                    yield name
+
+        if writer is not None:
+            for name in writer.results(wait=True):
+                yield name
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+# estimated cost of a glyph beyond the length of its record, in bytes
+_GLYPH_COST = 256
+
+def _task_costs(ttfs, tasks):
+    'the estimated cost of each of tasks, from the length of the record\n'
+    'of its glyph.'
+    fonts = dict(ttfs)
+    costs = []
+    for k, i, options in tasks:
+        glyphs = fonts[k].glyf.glyphs
+        costs.append(
+            _GLYPH_COST + (glyphs.size(i) if 0 <= i < len(glyphs) else 0)
+        )
+
+    return costs
+
+def _schedule(tasks, costs, jobs):
+    'splits tasks into chunks for the workers, each from a single font.\n'
+    'the chunks get smaller with the cost left (guided scheduling), so that\n'
+    'the workers run out of work at about the same time, even when one\n'
+    'font is much larger than the others.'
+    left = sum(costs)
+    chunks = []
+    chunk = []
+    for task, cost in itertools.izip(tasks, costs):
+        if chunk and (not task[0] == chunk[0][0] or chunk_cost >= target):
+            chunks.append(chunk)
+            left -= chunk_cost
+            chunk = []
+        if not chunk:
+            target = max(left // (2 * jobs), 16 * _GLYPH_COST)
+            chunk_cost = 0
+        chunk.append(task)
+        chunk_cost += cost
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+def _report_throughput(sources, throughput, elapsed, fout):
+    fout.write('Fonts:\n')
+    for k, (path, index) in enumerate(sources):
+        glyphs, seconds = throughput[k]
+        fout.write(
+            '    {:>6} glyphs {:10.6f} s {:10.1f} glyphs/s  {}#{}\n'.format(
+                glyphs, seconds, glyphs / seconds if seconds else 0.0,
+                path, index,
+            )
+        )
+    glyphs = sum(glyphs for glyphs, seconds in throughput.values())
+    fout.write(
+        'Total: {} glyphs from {} fonts in {:.3f} s '
+        '({:.1f} glyphs/s)\n'.format(
+            glyphs, len(sources), elapsed,
+            glyphs / elapsed if elapsed else 0.0,
+        )
+    )
+
+
+def _shared_outname(ttfs, tasks, owners):
+    'the first output name given to glyphs of two different fonts, or None.\n'
+    'owners maps the names of the fonts checked before to their number.'
+    fonts = dict(ttfs)
+    for k, font_tasks in itertools.groupby(tasks, lambda task: task[0]):
+        font_tasks = list(font_tasks)
+        export = fonts[k].export(**font_tasks[0][2])
+        for k_, i, options in font_tasks:
+            name = export.format_outname(i)
+            if owners.setdefault(name, k) != k:
+                return name
+
+    return None
+
+def _find_duplicates(ttfs, tasks):
+    'splits tasks into the tasks to run and the (task, original) pairs of\n'
+    'the glyphs duplicating an earlier glyph of the same font.'
+    fonts = dict(ttfs)
+    unique = []
+    duplicates = []
+    for k, font_tasks in itertools.groupby(tasks, lambda task: task[0]):
+        font_tasks = list(font_tasks)
+        originals = fonts[k].glyf.glyphs.duplicates(
+            [i for k_, i, options in font_tasks]
+        )
+        for task in font_tasks:
+            if task[1] in originals:
+                duplicates.append((task, originals[task[1]]))
+            else:
+                unique.append(task)
+
+    return unique, duplicates
+
+def _save_duplicates(fonts, duplicates, archive, namespace, manifest, keys):
+    aliases = {}
+    for (k, i, options), original in duplicates:
+        export = fonts[k].export(archive=archive, **options)
+        if namespace.dedup == 'alias':
+            name = export.format_outname(i)
+            target = export.format_outname(original)
+            aliases[name] = target
             if not namespace.q:
-                print 'Saved:', name
+                print 'Aliased:', name, '->', target
+            continue
+
+        name = export.link(i, original, namespace.dedup == 'symlink')
+        if manifest is not None:
+            manifest.add(keys[k], i)
+        if not namespace.q:
+            print 'Linked:', name, '->', export.format_outname(original)
+
+    if aliases:
+        # keep the aliases of the glyphs left out of this run
+        try:
+            with open(namespace.aliases) as fin:
+                merged = json.load(fin)
+        except (IOError, ValueError):
+            merged = {}
+        merged.update(aliases)
+        with open(namespace.aliases, 'w') as fout:
+            json.dump(merged, fout, sort_keys=True)
+
+
+def _save_metrics(fonts, tasks, filename):
+    'saves the metrics of the glyphs of tasks, in the order of the fonts\n'
+    'and then of the glyph indices, with the font in the first column.'
+    columns = OrderedDict([('font', array('H'))])
+    for k, font_tasks in itertools.groupby(tasks, lambda task: task[0]):
+        ttf_ = fonts[k]
+        indices = sorted(
+            i for k_, i, options in font_tasks
+            if 0 <= i < ttf_.maxp.num_glyphs
+        )
+        columns['font'].extend([k] * len(indices))
+        for name, column in ttf_.metrics(indices).items():
+            columns.setdefault(name, array(column.typecode)).extend(column)
+
+    ttfutil.save_metrics(filename, columns)
+
+
+def _add_to_atlas(fonts, tasks, atlas):
+    for k, font_tasks in itertools.groupby(tasks, lambda task: task[0]):
+        ttf_ = fonts[k]
+        indices = [i for k_, i, options in font_tasks]
+        for block in ttf_.glyf.glyphs.prefetch(indices):
+            for i in block:
+                atlas.add(
+                    ttf_.render_bitmap(i, atlas.size),
+                    font=k, index=i, gname=ttf_.post.names[i],
+                )
+
+
+_worker_fonts = None
+_worker_stats = None
+
+def _init_worker(sources, cache_dir, stats):
+    global _worker_fonts, _worker_stats
+    if stats:
+        _worker_stats = ttfutil.TTFStats()
+    _worker_fonts = ttfutil.FontFiles(sources, cache_dir, _worker_stats)
+
+def _worker_font(k):
+    'the font k of the sources; a worker gets the chunks in order, so it\n'
+    'opens each file once and keeps only one open.'
+    return _worker_fonts[k]
+
+def _save_glyph(task):
+    k, index, options = task
+    name = _worker_font(k).save(index, **options)
+    if _worker_stats is not None:
+        # hand the record over to the main process
+        return name, _worker_stats.glyphs.pop()
+    return name
+
+def _render_glyph(task):
+    k, index, options = task
+    export = _worker_font(k).export(**options)
+    name, data = export.format_outname(index), export.render(index)
+    if _worker_stats is not None:
+        return name, data, _worker_stats.glyphs.pop()
+    return name, data
+
+def _save_chunk(chunk):
+    start = time.time()
+    results = [_save_glyph(task) for task in chunk]
+    return results, time.time() - start
+
+def _render_chunk(chunk):
+    start = time.time()
+    results = [_render_glyph(task) for task in chunk]
+    return results, time.time() - start
+
+def _unchunk(chunks, results, throughput):
+    'yields the results of each chunk in turn, adding the time the worker\n'
+    'took for it to the font of the chunk.'
+    for chunk, (results_, seconds) in itertools.izip(chunks, results):
+        throughput[chunk[0][0]][1] += seconds
+        for result in results_:
+            yield result
+
+def _add_stats(stats, results):
+    for name, record in results:
+        stats.glyphs.append(record)
+        yield name
+
+def _add_to_archive(archive, rendered, stats=None):
+    for result in rendered:
+        name, data = result[:2]
+        start = time.time()
+        archive.add(name, data)
+        if stats is not None:
+            stats.glyphs.append(result[2])
+            stats.add_write(time.time() - start)
+        yield name
 
 
 if __name__ == '__main__':
@@ -1,38 +1,69 @@
 #!/usr/bin/env python
 
+import bisect
 import datetime
+import hashlib
+import itertools
+import json
+import math
+import mmap
 import os
 import struct
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from array import array
+from Queue import Empty, Queue
+from collections import OrderedDict
 from StringIO import StringIO
 
 from name_table import *
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # Reference:
 # https://developer.apple.com/fonts/TrueType-Reference-Manual/
 
 _version = '0.2'
 
+_LITTLE_ENDIAN = (sys.byteorder == 'little')
+
 
 class TTCObject(object):
-    def __init__(self, fin, offset=0):
+    def __init__(
+            self, fin, offset=0,
+            glyph_cache_size=1024,
+            use_mmap=True,
+            cache_dir=None,
+            stats=None,
+            header_only=False,
+    ):
         self.fin = fin
-        self.fin.seek(0)
+        self.reader = TTFReader(fin, use_mmap=use_mmap)
+        stream = self.reader.stream(0, 0xc)
 
-        self.ttc_tag = self.fin.read(4)
+        self.ttc_tag = stream.read(4)
         if not self.ttc_tag == 'ttcf':
             raise ValueError(
                 'This file seems to be not TTC format.\n'
                 'Magic: {!r} {!r} {!r} {!r}'.format(*self.ttc_tag)
             )
 
-        self.version = fixed(self.fin.read(4))
+        self.version = fixed(stream.read(4))
         if self.version in (1.0, 2.0):
-            self.num_fonts, = struct.unpack('>I', self.fin.read(4))
+            self.num_fonts, = struct.unpack('>I', stream.read(4))
+            stream = self.reader.stream(0xc, 4 * self.num_fonts + 0xc)
             self.offset_table = []
             for i in range(self.num_fonts):
                 self.offset_table.append(
-                    struct.unpack('>I', self.fin.read(4))[0]
+                    struct.unpack('>I', stream.read(4))[0]
                 )
         else:
             raise ValueError(
@@ -46,111 +77,1235 @@ class TTCObject(object):
                 self.dsig_tag,
                 self.dsig_length,
                 self.dsig_offset,
-            ) = struct.unpack('4s2I', self.fin.read(0xc))
+            ) = struct.unpack('4s2I', stream.read(0xc))
 
+        # member fonts often point at the same tables; parse those once
+        self.table_cache = {}
         self.ttfs = []
         for i in range(self.num_fonts):
             self.ttfs.append(
-                TTFObject(self.fin, self.offset_table[i])
+                TTFObject(
+                    self.fin, self.offset_table[i],
+                    glyph_cache_size=glyph_cache_size,
+                    reader=self.reader,
+                    table_cache=self.table_cache,
+                    cache_dir=cache_dir,
+                    stats=stats,
+                    font_index=i,
+                    header_only=header_only,
+                )
             )
 
+    def close(self):
+        'closes the file shared by the fonts; see TTFObject.close().'
+        self.reader.close()
+        self.fin.close()
+
 
 class TTFObject(object):
-    def __init__(self, fin, offset=0):
+    def __init__(
+            self, fin, offset=0,
+            glyph_cache_size=1024,
+            reader=None,
+            use_mmap=True,
+            table_cache=None,
+            cache_dir=None,
+            stats=None,
+            font_index=0,
+            header_only=False,
+    ):
+        'only the table directory is read here; each table is parsed (or\n'
+        'loaded from cache_dir) when it is first used.\n'
+        'header_only - leaves the tables other than head, maxp, name and\n'
+        '  post None, e.g. to list the fonts of a collection.'
         self.fin = fin
-        self.fin.seek(offset)
-
-        self.sfnt_version = fixed(self.fin.read(4))
+        self.stats = stats
+        self.font_index = font_index
+        if reader is None:
+            reader = TTFReader(fin, use_mmap=use_mmap)
+        self.reader = reader
+        stream = self.reader.stream(offset, 0xc)
+
+        self.sfnt_version = fixed(stream.read(4))
         (
             self.num_of_tables,
             self.search_range,      # (max power of 2 <= num_of_tables) * 16
             self.entry_selector,    # (log[2](max power of 2 <= num_of_tables)
             self.range_shift,       # num_of_tables * 16 - search_range
-        ) = struct.unpack('>4H', self.fin.read(8))
+        ) = struct.unpack('>4H', stream.read(8))
 
+        stream = self.reader.stream(offset + 0xc, 0x10 * self.num_of_tables)
         self.tables = {}
         for i in range(self.num_of_tables):
             (
                 table_name, checksum, offset, length
-            ) = struct.unpack('>4s3I', self.fin.read(0x10))
+            ) = struct.unpack('>4s3I', stream.read(0x10))
 
             self.tables[table_name] = TTFTable(checksum, offset, length)
 
-        self.head = TTFHead(self)
-        self.hhea = TTFHHea(self)
-        self.maxp = TTFMaxP(self)
-        self.name = TTFName(self)
-        self.os_2 = TTFOS_2(self)
-        self.post = TTFPost(self)
-        self.cmap = TTFCMap(self)
-        self.hmtx = TTFHMtx(self)
-        self.loca = TTFLoca(self)
-        self.glyf = TTFGlyf(self)
+        self.table_cache = table_cache
+        self.disk_cache = None
+        if cache_dir is not None:
+            self.disk_cache = TTFDiskCache(cache_dir, fin)
+        self._export = None
+
+        # attribute -> (tag, parser); each table is parsed when first used
+        self._parsers = {
+            'head': ('head', TTFHead),
+            'hhea': ('hhea', TTFHHea),
+            'maxp': ('maxp', TTFMaxP),
+            'name': ('name', TTFName),
+            'os_2': ('OS/2', TTFOS_2),
+            'post': ('post', TTFPost),
+            'cmap': ('cmap', TTFCMap),
+            'hmtx': ('hmtx', TTFHMtx),
+            'loca': ('loca', TTFLoca),
+            'glyf': (
+                'glyf', lambda ttf: TTFGlyf(ttf, cache_size=glyph_cache_size),
+            ),
+        }
+        if header_only:
+            for attr in ('hhea', 'os_2', 'cmap', 'hmtx', 'loca', 'glyf'):
+                setattr(self, attr, None)
+
+    def __getattr__(self, attr):
+        parsers = self.__dict__.get('_parsers', {})
+        if attr not in parsers:
+            raise AttributeError(
+                '{!r} object has no attribute {!r}'.format(
+                    type(self).__name__, attr,
+                )
+            )
+
+        tag, parse = parsers[attr]
+        table = self.parse_table(tag, parse, *self.depends(attr))
+        setattr(self, attr, table)
+        return table
+
+    def depends(self, attr):
+        'the values the parser of a table takes from the other tables,\n'
+        'which are parsed first.'
+        if attr == 'post':
+            return (self.maxp.num_glyphs,)
+        if attr == 'hmtx':
+            return (self.hhea.num_of_long_hor_metrics, self.maxp.num_glyphs)
+        if attr == 'loca':
+            return (self.head.index_to_loc_format, self.maxp.num_glyphs)
+        if attr == 'glyf':
+            # parse loca first, so that its time is not counted as glyf's
+            self.loca
+            return (self.table_key('loca'),) + self.depends('loca')
+        return ()
+
+    def parse_tables(self, *attrs):
+        'parses the tables (all by default) now, instead of when they are\n'
+        'first used; e.g. to find a broken font early.'
+        for attr in attrs or sorted(self._parsers):
+            getattr(self, attr)
+
+    def parse_table(self, tag, parse, *depends):
+        'parses the table with parse(self).  with a table_cache, a table is\n'
+        'parsed only once per (tag, offset, length, checksum) and depends,\n'
+        'the values parse takes from other tables (e.g. the number of\n'
+        'glyphs), and shared between the fonts.  with a disk_cache, tables\n'
+        'it supports are loaded from and stored into it.  with stats, the\n'
+        'time taken is added to the tag.'
+        if self.stats is not None:
+            start = time.time()
+            table = self._parse_table(tag, parse, *depends)
+            self.stats.add_table(tag, time.time() - start)
+            return table
+
+        return self._parse_table(tag, parse, *depends)
+
+    def _parse_table(self, tag, parse, *depends):
+        # the member fonts of a TTC usually have their own head and maxp,
+        # so the key has the values used from them and not their ranges
+        key = (self.table_key(tag),) + depends
+        if self.table_cache is not None and key in self.table_cache:
+            return self.table_cache[key]
+
+        if (
+            self.disk_cache is not None and tag in TTFDiskCache.TAGS
+            and self.tables[tag].length >= TTFDiskCache.MIN_LENGTH
+        ):
+            table = self.disk_cache.load(key)
+            if table is None:
+                table = parse(self)
+                self.disk_cache.store(key, table)
+        else:
+            table = parse(self)
+
+        if self.table_cache is not None:
+            self.table_cache[key] = table
+
+        return table
+
+    def table_key(self, tag):
+        table = self.tables[tag]
+        return (tag, table.offset, table.length, table.checksum)
+
+    def table_data(self, tag):
+        table = self.tables[tag]
+        return self.reader.slice(table.offset, table.length)
+
+    def table_stream(self, tag):
+        table = self.tables[tag]
+        return self.reader.stream(table.offset, table.length)
+
+    def close(self):
+        'closes the file and its mapping, which the other fonts of a TTC\n'
+        'share; the tables parsed so far can still be used, but no glyph\n'
+        'or table can be read any more.'
+        self.reader.close()
+        self.fin.close()
 
 
     def save(
             self, index,
             outname='{index}-{gname}.svg',
             scale=1.0,
+            archive=None,
+            precision=None,
+            compact=False,
+            path=None,
     ):
         'variables:\n'
         '  {index} - glyph index\n'
         '  {gname} - glyph name\n'
         '  {fname} - font name\n'
+        '  {file} - name of the font file, without the extension\n'
+        '  {path} - path, or else the path of the font file, without the\n'
+        '    extension\n'
+        '  {font} - index of the font in its file (0 unless a TTC)\n'
         'you can use python-style format\n'
-        'e.g. "0x{name:0>2x}-{name}.svg"'
-        name = self.post.names[index]
+        'e.g. "0x{name:0>2x}-{name}.svg"\n'
+        'if archive (an SVGArchive) is given, the glyph is added to it\n'
+        'as a member instead of being written to its own file.\n'
+        'precision - digits after the decimal point (None: all)\n'
+        'compact - writes relative path commands and no extra whitespace'
+        return self.export(
+            outname, scale, archive, precision, compact, path,
+        ).save(index)
+
+    def export(
+            self,
+            outname='{index}-{gname}.svg',
+            scale=1.0,
+            archive=None,
+            precision=None,
+            compact=False,
+            path=None,
+    ):
+        'returns the TTFExport for the given options; the last one is kept\n'
+        'so that repeated save() calls share it.'
+        key = (outname, scale, archive, precision, compact, path)
+        if self._export is None or not self._export.key == key:
+            self._export = TTFExport(
+                self, outname, scale, archive, precision, compact, path,
+            )
 
-        x_min = self.head.x_min
-        x_max = self.head.x_max
-        y_min = self.head.y_min
-        y_max = self.head.y_max
+        return self._export
 
-        if self.glyf.glyphs[index] is None:
-            string = '<svg/>'
+    def format_outname(self, index, outname, path=None):
+        return self.export(outname, path=path).format_outname(index)
 
+    def write_svg(
+            self, index, write,
+            scale=1.0,
+            precision=None,
+            compact=False,
+    ):
+        'writes the SVG document of the glyph piece by piece to write,\n'
+        'e.g. fout.write or list.append.'
+        self.export(
+            scale=scale, precision=precision, compact=compact,
+        ).write_svg(index, write)
+
+    def render_svg(self, index, scale=1.0, precision=None, compact=False):
+        'returns the SVG document of the glyph as a string.'
+        return self.export(
+            scale=scale, precision=precision, compact=compact,
+        ).render(index)
+
+    def iter_svgs(
+            self,
+            indices=None,
+            scale=1.0,
+            precision=None,
+            compact=False,
+    ):
+        'yields (index, glyph name, SVG document) for the glyphs in indices,\n'
+        'or for all glyphs if None, without touching the filesystem.\n'
+        'glyphs are decoded and yielded lazily, in the order they are\n'
+        'stored in the font.'
+        return self.export(
+            scale=scale, precision=precision, compact=compact,
+        ).iter_svgs(indices)
+
+    def render_bitmap(self, index, size=32, supersample=4):
+        'renders the glyph into a size x size square, into which the\n'
+        'bounding box of the font is fitted, and returns it as a NumPy\n'
+        'array of grays, 255 for the paper and 0 for the ink.  each pixel\n'
+        'averages supersample x supersample samples.  needs NumPy.'
+        if numpy is None:
+            raise ImportError('render_bitmap() needs NumPy')
+
+        x_min = self.head.x_min
+        y_max = self.head.y_max
+        units = max(
+            self.head.x_max - x_min, y_max - self.head.y_min, 1
+        )
+        pixels = size * supersample
+        scale = float(pixels) / units
+
+        polygons = []
+        for path in self.glyf.outline(index):
+            for flags, points in path:
+                polygons.append([
+                    ((x - x_min) * scale, (y_max - y) * scale)
+                    for x, y in flatten_contour(flags, points)
+                ])
+
+        coverage = rasterize(polygons, pixels, pixels).reshape(
+            size, supersample, size, supersample
+        ).mean(axis=(1, 3))
+        return (255 - numpy.round(255 * coverage)).astype(numpy.uint8)
+
+    def metrics(self, indices=None):
+        'the horizontal metrics and the bounding boxes of the glyphs in\n'
+        'indices (None: all), read from hmtx and the headers of the glyph\n'
+        'records without decoding the outlines.  returns an OrderedDict\n'
+        'of the columns, each an array with an entry per glyph.'
+        if indices is None:
+            indices = range(self.maxp.num_glyphs)
+
+        columns = OrderedDict(
+            (name, array(typecode)) for name, typecode in _METRIC_COLUMNS
+        )
+        columns['index'].extend(indices)
+        advance_widths = self.hmtx.advance_widths
+        left_side_bearings = self.hmtx.left_side_bearings
+        columns['advance_width'].extend(advance_widths[i] for i in indices)
+        columns['left_side_bearing'].extend(
+            left_side_bearings[i] for i in indices
+        )
+        for header in self.glyf.glyphs.headers(indices):
+            columns['number_of_contours'].append(header[0])
+            columns['x_min'].append(header[1])
+            columns['y_min'].append(header[2])
+            columns['x_max'].append(header[3])
+            columns['y_max'].append(header[4])
+
+        return columns
+
+
+class TTFExport(object):
+    'per-font state of an export: the font name, the SVG header and the\n'
+    'output directories already known to exist are computed once, so\n'
+    'render() and save() only have to do the work for the glyph itself.'
+    def __init__(
+            self, ttf,
+            outname='{index}-{gname}.svg',
+            scale=1.0,
+            archive=None,
+            precision=None,
+            compact=False,
+            path=None,
+    ):
+        self.ttf = ttf
+        self.outname = outname
+        self.scale = scale
+        self.archive = archive
+        self.precision = precision
+        self.compact = compact
+        self.key = (outname, scale, archive, precision, compact, path)
+
+        self.fname = ttf.name.find(1, 0, 0, 6)  # PostScript name
+        filename = getattr(ttf.fin, 'name', '')
+        self.file = os.path.splitext(os.path.basename(filename))[0]
+        if path is None:
+            path = os.path.splitext(filename)[0]
+        self.path = path
+
+        x_min = ttf.head.x_min
+        x_max = ttf.head.x_max
+        y_min = ttf.head.y_min
+        y_max = ttf.head.y_max
+
+        if compact:
+            header = (
+                '<svg width="{x}" height="{y}" '
+                'viewBox="{offset_x} {offset_y} {x} {y}" '
+                'xmlns="http://www.w3.org/2000/svg">'
+            )
         else:
-            string = (
+            header = (
                 '<svg\n'
                 '    width="{x}"\n'
                 '    height="{y}"\n'
                 '    viewBox="{offset_x} {offset_y} {x} {y}"\n'
                 '    xmlns="http://www.w3.org/2000/svg"\n'
-                '>\n'.format(
-                    x=scale*(x_max-x_min+1),
-                    y=scale*(y_max-y_min+1),
-                    offset_x=scale*x_min,
-                    offset_y=scale*(-y_max),
-                )
+                '>\n'
             )
-            string += self.glyf.draw_line(index, scale=scale)
-            string += '</svg>'
-
-        for i, nr in enumerate(self.name.name_record_array):
-            if (
-                nr.platform_id,
-                nr.specific_id,
-                nr.language_id,
-                nr.name_id,
-            ) == (1, 0, 0, 6):
-                fname = self.name.get_string(i)
-                break
+
+        sizes = dict(
+            x=scale*(x_max-x_min+1),
+            y=scale*(y_max-y_min+1),
+            offset_x=scale*x_min,
+            offset_y=scale*(-y_max),
+        )
+        if precision is not None or compact:
+            for key, value in sizes.items():
+                sizes[key] = format_number(value, precision)
+        self.header = header.format(**sizes)
+
+        self.directories = set()
+
+    def save(self, index):
+        return self.write(index, self.render(index))
+
+    def render(self, index):
+        stats = self.ttf.stats
+        if stats is not None:
+            start = time.time()
+            decoding = stats.decode_seconds
+
+        chunks = []
+        self.write_svg(index, chunks.append)
+        data = ''.join(chunks)
+
+        if stats is not None:
+            # the glyphs decoded while rendering are accounted separately
+            stats.add_glyph(
+                self.ttf.font_index, index,
+                time.time() - start - (stats.decode_seconds - decoding),
+                0.0, len(data),
+            )
+
+        return data
+
+    def iter_svgs(self, indices=None):
+        glyphs = self.ttf.glyf.glyphs
+        if indices is None:
+            indices = range(len(glyphs))
+
+        for block in glyphs.prefetch(indices):
+            for index in block:
+                yield index, self.ttf.post.names[index], self.render(index)
+
+    def write(self, index, data, record=-1):
+        'writes the rendered glyph to its file, or to the archive;\n'
+        'returns the output name.\n'
+        'record - position in stats.glyphs of the glyph (the last one)'
+        stats = self.ttf.stats
+        if stats is not None:
+            start = time.time()
+
+        outname = self.format_outname(index)
+        if self.archive is not None:
+            self.archive.add(outname, data)
+        else:
+            self.makedir(os.path.dirname(outname))
+            with open(outname, 'w') as fout:
+                fout.write(data)
+
+        if stats is not None:
+            stats.add_write(time.time() - start, record)
+
+        return outname
+
+    def link(self, index, original, symbolic=False):
+        'makes the output of the glyph a hard or symbolic link to that of\n'
+        'original, which has to be written already; returns the output name.'
+        if self.archive is not None:
+            raise ValueError('cannot link the members of an archive')
+
+        outname = self.format_outname(index)
+        target = self.format_outname(original)
+        if outname == target:
+            return outname
+
+        dirname = os.path.dirname(outname)
+        self.makedir(dirname)
+        if os.path.lexists(outname):
+            os.remove(outname)
+        if symbolic:
+            os.symlink(os.path.relpath(target, dirname or os.curdir), outname)
         else:
-            fname = ''
+            os.link(target, outname)
 
-        outname = outname.format(
+        return outname
+
+    def format_outname(self, index):
+        name = self.ttf.post.names[index]
+        return self.outname.format(
             index=index,
             name=name,
-            fname=fname,
+            gname=name,
+            fname=self.fname,
+            file=self.file,
+            path=self.path,
+            font=self.ttf.font_index,
         )
 
-        if not os.path.isdir(os.path.dirname(outname)):
-            os.mkdir(os.path.dirname(outname))
+    def write_svg(self, index, write):
+        if self.ttf.glyf.glyphs[index] is None:
+            write('<svg/>')
+            return
+
+        write(self.header)
+        self.ttf.glyf.draw_line(
+            index,
+            scale=self.scale,
+            write=write,
+            precision=self.precision,
+            compact=self.compact,
+        )
+        write('</svg>')
+
+    def makedir(self, dirname):
+        if not dirname or dirname in self.directories:
+            return
+
+        if not os.path.isdir(dirname):
+            # e.g. {path}/{font}/ needs the directories above it first
+            self.makedir(os.path.dirname(dirname))
+            try:
+                os.mkdir(dirname)
+            except OSError:
+                # another process may have created it in the meantime
+                if not os.path.isdir(dirname):
+                    raise
+
+        self.directories.add(dirname)
+
+
+class TTFReader(object):
+    'random access to a font file.\n'
+    'the file is mapped into memory once and slices of it are handed out\n'
+    'as buffers without copying; files that cannot be mapped (pipes,\n'
+    'StringIO, ...) are read through seek() and read() instead.'
+    def __init__(self, fin, use_mmap=True):
+        self.fin = fin
+        self.map = None
+        if use_mmap:
+            try:
+                self.map = mmap.mmap(
+                    fin.fileno(), 0, access=mmap.ACCESS_READ
+                )
+            except (AttributeError, EnvironmentError, ValueError):
+                self.map = None
 
-        with open(outname, 'w') as fout:
-            fout.write(string)
+    def slice(self, offset, length):
+        if self.map is not None:
+            return buffer(self.map, offset, length)
 
-        return outname
+        self.fin.seek(offset)
+        return self.fin.read(length)
+
+    def stream(self, offset, length):
+        return TTFStream(self.slice(offset, length))
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+class TTFStream(object):
+    'file-like object over a table slice; read() copies only what it returns.'
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, size=-1):
+        start = self.pos
+        if size < 0:
+            self.pos = len(self.data)
+        else:
+            self.pos = min(start + size, len(self.data))
+        return self.data[start:self.pos]
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += len(self.data)
+        self.pos = max(pos, 0)
+
+    def tell(self):
+        return self.pos
+
+
+class SVGArchive(object):
+    'writes SVGs as members of a single tar or zip archive.\n'
+    'the format follows the extension of filename: .zip, .tar, .tar.gz,\n'
+    '.tgz or .tar.bz2.  compress deflates each member of a zip archive;\n'
+    'tar archives are compressed as a whole according to the extension.\n'
+    'writes go through a buffer of buffer_size bytes.'
+    def __init__(self, filename, compress=False, buffer_size=1 << 20):
+        self.fout = open(filename, 'wb', buffer_size)
+        self.date_time = time.localtime()[:6]
+        if filename.endswith('.zip'):
+            if compress:
+                self.compress_type = zipfile.ZIP_DEFLATED
+            else:
+                self.compress_type = zipfile.ZIP_STORED
+            self.zip = zipfile.ZipFile(self.fout, 'w', allowZip64=True)
+            self.tar = None
+        else:
+            if filename.endswith(('.tar.gz', '.tgz')):
+                mode = 'w|gz'
+            elif filename.endswith('.tar.bz2'):
+                mode = 'w|bz2'
+            else:
+                mode = 'w|'
+            self.tar = tarfile.open(fileobj=self.fout, mode=mode)
+            self.zip = None
+
+    def add(self, name, data):
+        if self.zip is not None:
+            info = zipfile.ZipInfo(name, self.date_time)
+            info.compress_type = self.compress_type
+            info.external_attr = 0644 << 16
+            self.zip.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.mktime(self.date_time + (0, 0, -1))
+            info.mode = 0644
+            self.tar.addfile(info, StringIO(data))
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+        else:
+            self.tar.close()
+        self.fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BackgroundWriter(object):
+    'makes the calls put() from threads in the background, so that the\n'
+    'next glyphs can be rendered while the last ones are written.  put()\n'
+    'blocks while queue_size calls are pending, which bounds the memory\n'
+    'held by them.  results() hands back what the calls returned, in the\n'
+    'order they were put and only once they have finished; the first\n'
+    'error raised by a call is raised there in its turn instead, and the\n'
+    'calls pending by then are dropped.'
+    # what a dropped call leaves instead of its result
+    DROPPED = object()
+
+    def __init__(self, threads=1, queue_size=64):
+        self.queue = Queue(queue_size)
+        # (number of the call, result, sys.exc_info() or DROPPED or None)
+        self.done = Queue()
+        self.finished = {}
+        self.submitted = 0
+        self.returned = 0
+        self.error = None
+        self.threads = []
+        for _ in range(threads):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, write, *args):
+        'calls write(*args) in the background.'
+        self.queue.put((self.submitted, write, args))
+        self.submitted += 1
+
+    def results(self, wait=False):
+        'yields the results of the calls finished so far, in order; with\n'
+        'wait, waits for all the calls put.'
+        while self.returned < self.submitted:
+            if self.returned not in self.finished:
+                try:
+                    number, result, error = self.done.get(wait)
+                except Empty:
+                    return
+                self.finished[number] = (result, error)
+                continue
+
+            result, error = self.finished.pop(self.returned)
+            self.returned += 1
+            if error is self.DROPPED:
+                error = self.error
+            if error is not None:
+                raise error[0], error[1], error[2]
+            yield result
+
+    def close(self):
+        'stops the threads once the pending calls are done or dropped.'
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _run(self):
+        while True:
+            call = self.queue.get()
+            if call is None:
+                return
+            number, write, args = call
+            if self.error is not None:
+                self.done.put((number, None, self.DROPPED))
+                continue
+            try:
+                self.done.put((number, write(*args), None))
+            except Exception:
+                self.error = sys.exc_info()
+                self.done.put((number, None, self.error))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GlyphAtlas(object):
+    'packs glyph bitmaps of size x size pixels, row by row, into a single\n'
+    'grayscale image, written as PGM or PNG according to the extension\n'
+    'of filename (.pgm or .png).  the position of each glyph goes into\n'
+    'an index, a JSON file named after the image with a .json extension.\n'
+    'count is the number of glyphs to be added.  needs NumPy.'
+    def __init__(self, filename, count, size=32, columns=None):
+        if numpy is None:
+            raise ImportError('GlyphAtlas needs NumPy')
+        if not filename.endswith(('.pgm', '.png')):
+            raise ValueError(
+                'unknown image format: {!r}'.format(filename)
+            )
+
+        if columns is None:
+            columns = int(math.ceil(math.sqrt(count)))
+        columns = max(columns, 1)
+        rows = max((count + columns - 1) // columns, 1)
+
+        self.filename = filename
+        self.size = size
+        self.columns = columns
+        self.image = numpy.empty((rows * size, columns * size), numpy.uint8)
+        self.image.fill(255)
+        self.glyphs = []
+
+    def add(self, bitmap, **info):
+        'places bitmap in the next cell; info (e.g. the glyph index and\n'
+        'name) goes into the index along with the position of the cell.'
+        row, column = divmod(len(self.glyphs), self.columns)
+        x = column * self.size
+        y = row * self.size
+        self.image[y:y+self.size, x:x+self.size] = bitmap
+
+        info['x'] = x
+        info['y'] = y
+        self.glyphs.append(info)
+
+    def save(self):
+        with open(self.filename, 'wb') as fout:
+            if self.filename.endswith('.png'):
+                write_png(fout, self.image)
+            else:
+                write_pgm(fout, self.image)
+
+        index = {
+            'image': os.path.basename(self.filename),
+            'size': self.size,
+            'columns': self.columns,
+            'glyphs': self.glyphs,
+        }
+        indexname = os.path.splitext(self.filename)[0] + '.json'
+        with open(indexname, 'w') as fout:
+            json.dump(index, fout, sort_keys=True)
+
+
+class FontFiles(object):
+    'the fonts of sources, a list of (path, font index), by number.  a\n'
+    'file is opened when one of its fonts is asked for, and closed when a\n'
+    'font of another file is, so that only one file is open at a time\n'
+    'however many there are; asked for in order, each file is opened once.'
+    def __init__(self, sources, cache_dir=None, stats=None):
+        self.sources = sources
+        self.cache_dir = cache_dir
+        self.stats = stats
+        self.path = None
+        # the fonts of the open file by their index in it
+        self.ttfs = {}
+
+    def __getitem__(self, k):
+        path, index = self.sources[k]
+        if not path == self.path:
+            self.reuse(path, enumerate(self.open(path)))
+
+        return self.ttfs[index]
+
+    def open(self, path):
+        fin = open(path, 'rb')
+        try:
+            if fin.read(4) == 'ttcf':
+                return TTCObject(
+                    fin, cache_dir=self.cache_dir, stats=self.stats,
+                ).ttfs
+            return [
+                TTFObject(fin, cache_dir=self.cache_dir, stats=self.stats),
+            ]
+        except Exception:
+            fin.close()
+            raise
+
+    def reuse(self, path, ttfs):
+        'takes ttfs, [(font index, TTFObject)] of path opened elsewhere, as\n'
+        'the open file, so that path is not opened again.'
+        self.close()
+        self.path = path
+        self.ttfs = dict(ttfs)
+
+    def close(self):
+        for ttf in self.ttfs.values():
+            ttf.close()
+        self.path = None
+        self.ttfs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TTFManifest(object):
+    'record of the glyphs already exported, kept in a JSON file.\n'
+    'each font has a fingerprint of its inputs (table checksums, font\n'
+    'revision, scale and output template); its glyphs are only taken as\n'
+    'done while the fingerprint is unchanged.  every flush_every glyphs,\n'
+    'the ones added since are appended to a journal next to the file, so\n'
+    'an interrupted run can be resumed; save() merges the journal into the\n'
+    'file, which is only rewritten there.'
+    def __init__(self, filename, flush_every=256):
+        self.filename = filename
+        self.journal = filename + '.journal'
+        self.flush_every = flush_every
+        # glyph indices added since the last flush, by font
+        self.pending = {}
+        self.count = 0
+        # fonts started over since the last flush
+        self.reset = set()
+        # whether the journal ends in a line cut short
+        self.torn = False
+        try:
+            with open(filename) as fin:
+                self.fonts = json.load(fin)['fonts']
+        except (IOError, ValueError, KeyError):
+            self.fonts = {}
+
+        for entry in self.fonts.values():
+            entry['done'] = set(entry['done'])
+        self.replay()
+
+    @staticmethod
+    def fingerprint(ttf, outname, scale, precision=None, compact=False):
+        fingerprint = {
+            'version': _version,
+            'checksums': dict(
+                (tag, table.checksum) for tag, table in ttf.tables.items()
+            ),
+            'font_revision': ttf.head.font_revision,
+            'outname': outname,
+            'scale': scale,
+        }
+        # only when given, so that earlier manifests stay valid
+        if precision is not None:
+            fingerprint['precision'] = precision
+        if compact:
+            fingerprint['compact'] = compact
+        return fingerprint
+
+    def done(self, key, fingerprint):
+        'returns the set of glyph indices done for the font; starts over\n'
+        'if the fingerprint has changed.'
+        entry = self.fonts.get(key)
+        if entry is None or not entry['fingerprint'] == fingerprint:
+            entry = self.fonts[key] = {
+                'fingerprint': fingerprint,
+                'done': set(),
+            }
+            self.reset.add(key)
+
+        return entry['done']
+
+    def add(self, key, index):
+        self.fonts[key]['done'].add(index)
+        self.pending.setdefault(key, []).append(index)
+        self.count += 1
+        if self.count >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        'appends the glyphs added since the last flush to the journal, a\n'
+        'JSON line [key, fingerprint or null, indices] per font; the\n'
+        'fingerprint is given when the font has started over.'
+        if not self.pending:
+            return
+
+        with open(self.journal, 'a') as fout:
+            if self.torn:
+                fout.write('\n')
+                self.torn = False
+            for key, indices in sorted(self.pending.items()):
+                fingerprint = None
+                if key in self.reset:
+                    fingerprint = self.fonts[key]['fingerprint']
+                fout.write(json.dumps([key, fingerprint, indices]) + '\n')
+
+        self.reset.difference_update(self.pending)
+        self.pending = {}
+        self.count = 0
+
+    def replay(self):
+        try:
+            fin = open(self.journal)
+        except IOError:
+            return
+
+        with fin:
+            for line in fin:
+                try:
+                    key, fingerprint, indices = json.loads(line)
+                except ValueError:
+                    # cut short by an interrupted run
+                    self.torn = not line.endswith('\n')
+                    continue
+                if fingerprint is not None:
+                    self.fonts[key] = {
+                        'fingerprint': fingerprint,
+                        'done': set(),
+                    }
+                if key in self.fonts:
+                    self.fonts[key]['done'].update(indices)
+
+    def save(self):
+        # everything goes to the journal first, so that it can be replayed
+        # onto the new file if the run stops before the journal is removed
+        self.flush()
+        fonts = {}
+        for key, entry in self.fonts.items():
+            fonts[key] = {
+                'fingerprint': entry['fingerprint'],
+                'done': sorted(entry['done']),
+            }
+
+        # write a new file and rename it, so that a crash never leaves a
+        # truncated manifest behind
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'w') as fout:
+            json.dump({'fonts': fonts}, fout, sort_keys=True)
+        os.rename(tmpname, self.filename)
+        try:
+            os.remove(self.journal)
+        except OSError:
+            pass
+
+
+class TTFDiskCache(object):
+    'on-disk cache of parsed tables.\n'
+    'each table goes into its own file in directory, named by a hash of\n'
+    'the path, size and mtime of the font file and of the table key (tag,\n'
+    'offset, length and checksum of the table and the values it takes\n'
+    'from other tables), so that only the tables used are loaded.  fonts\n'
+    'that are not regular files are not cached.\n'
+    'a file holds a JSON header describing the attributes of the table,\n'
+    'followed by the raw bytes of its arrays and strings.  only objects\n'
+    'of the classes in CLASSES are rebuilt from it, so loading a file\n'
+    'never runs anything stored in it.'
+    # head, maxp, hmtx and loca are parsed in bulk faster than even a
+    # small cache file can be opened and read, and so are post and cmap
+    # tables shorter than MIN_LENGTH; only the others are cached
+    TAGS = ('post', 'cmap')
+    MIN_LENGTH = 0x800
+    CLASSES = ('TTFPost', 'TTFCMap', 'TTFCMapSubtable', 'TTFCMapIndex')
+    MAGIC = 'TTFC'
+    # bump when the layout of the parsed tables changes
+    FORMAT = 3
+
+    def __init__(self, directory, fin):
+        self.directory = directory
+        try:
+            st = os.fstat(fin.fileno())
+            self.file_key = (
+                os.path.abspath(fin.name), st.st_size, st.st_mtime,
+            )
+        except (AttributeError, EnvironmentError, ValueError):
+            self.file_key = None
+
+    def path(self, key):
+        digest = hashlib.sha1(
+            repr((_version, self.FORMAT, self.file_key, key))
+        )
+        return os.path.join(self.directory, digest.hexdigest() + '.table')
+
+    def load(self, key):
+        if self.file_key is None:
+            return None
+
+        try:
+            with open(self.path(key), 'rb') as fin:
+                data = fin.read()
+            magic, version, length = struct.unpack_from('>4sHI', data)
+            if not (magic == self.MAGIC and version == self.FORMAT):
+                return None
+            header = json.loads(data[10:10+length])
+            return self.decode(header, data[10+length:])
+        except (
+                EnvironmentError, struct.error, ValueError, TypeError,
+                KeyError, IndexError, AttributeError,
+        ):
+            return None
+
+    def store(self, key, table):
+        if self.file_key is None:
+            return
+
+        data = bytearray()
+        try:
+            header = json.dumps(self.encode(table, data))
+        except TypeError:
+            return  # a table this format cannot hold is not cached
+
+        # write a new file and rename it, so that readers never see a
+        # partially written one; a cache that cannot be written is skipped
+        path = self.path(key)
+        tmpname = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(tmpname, 'wb') as fout:
+                fout.write(struct.pack(
+                    '>4sHI', self.MAGIC, self.FORMAT, len(header)
+                ))
+                fout.write(header)
+                fout.write(data)
+            os.rename(tmpname, path)
+        except EnvironmentError:
+            pass
+
+    def encode(self, value, data):
+        'describes value in JSON, appending its arrays and strings to data\n'
+        '(a bytearray); arrays are stored big-endian.'
+        if value is None or isinstance(value, (bool, int, long, float)):
+            return value
+        if isinstance(value, str):
+            data.extend(value)
+            return {'s': [len(data) - len(value), len(value)]}
+        if isinstance(value, unicode):
+            return {'u': value}
+        if isinstance(value, (tuple, list)) and value:
+            # sequences of ints, e.g. the cmap segments, and lists of rows
+            # of them, e.g. the cmap runs, go in as arrays of 32-bit ints
+            kind = 'T' if isinstance(value, tuple) else 'L'
+            if all(isinstance(row, tuple) for row in value):
+                width = len(value[0])
+                if all(len(row) == width for row in value):
+                    ints = int32_array(itertools.chain.from_iterable(value))
+                    if ints is not None:
+                        return {'R': [width, self.encode(ints, data)]}
+            else:
+                ints = int32_array(value)
+                if ints is not None:
+                    return {kind: self.encode(ints, data)}
+        if isinstance(value, tuple):
+            return {'t': [self.encode(item, data) for item in value]}
+        if isinstance(value, list):
+            if value and all(isinstance(item, str) for item in value):
+                # e.g. the glyph names: NUL-separated, or else their
+                # lengths followed by the bytes
+                joined = '\0'.join(value)
+                if joined.count('\0') == len(value) - 1:
+                    data.extend(joined)
+                    return {'Z': [len(data) - len(joined), len(joined)]}
+                lengths = self.encode(array('I', map(len, value)), data)
+                data.extend(''.join(value))
+                return {'S': lengths}
+            return {'l': [self.encode(item, data) for item in value]}
+        if isinstance(value, array):
+            values = array(value.typecode, value)
+            if _LITTLE_ENDIAN:
+                values.byteswap()
+            data.extend(values.tostring())
+            return {'a': [
+                value.typecode, len(data) - len(values) * values.itemsize,
+                len(values),
+            ]}
+        if isinstance(value, dict):
+            return {'d': [
+                [self.encode(k, data), self.encode(v, data)]
+                for k, v in value.items()
+            ]}
+        if type(value).__name__ in self.CLASSES:
+            if hasattr(value, '__getstate__'):
+                state = value.__getstate__()
+            else:
+                state = value.__dict__
+            return {'o': [
+                type(value).__name__,
+                dict((k, self.encode(v, data)) for k, v in state.items()),
+            ]}
+
+        raise TypeError('cannot cache {!r}'.format(type(value)))
+
+    def decode(self, value, data):
+        'rebuilds a value from encode() and the data after the header.'
+        if not isinstance(value, dict):
+            return value
+
+        (kind, args), = value.items()
+        if kind == 's':
+            offset, length = args
+            return data[offset:offset+length]
+        if kind == 'u':
+            return args
+        if kind == 't':
+            return tuple(self.decode(item, data) for item in args)
+        if kind == 'T':
+            return tuple(self.decode(args, data))
+        if kind == 'L':
+            return self.decode(args, data).tolist()
+        if kind == 'R':
+            width, ints = args
+            ints = self.decode(ints, data)
+            return zip(*[ints[i::width] for i in range(width)])
+        if kind == 'Z':
+            offset, length = args
+            return data[offset:offset+length].split('\0')
+        if kind == 'S':
+            lengths = self.decode(args, data)
+            offset = args['a'][1] + lengths.itemsize * len(lengths)
+            names = []
+            for length in lengths:
+                names.append(data[offset:offset+length])
+                offset += length
+            return names
+        if kind == 'l':
+            return [self.decode(item, data) for item in args]
+        if kind == 'a':
+            typecode, offset, count = args
+            size = array(str(typecode)).itemsize
+            return big_endian_array(
+                str(typecode), data[offset:offset+size*count]
+            )
+        if kind == 'd':
+            return dict(
+                (self.decode(k, data), self.decode(v, data)) for k, v in args
+            )
+        if kind == 'o':
+            name, state = args
+            if name not in self.CLASSES:
+                raise ValueError('unexpected class {!r}'.format(name))
+            cls = globals()[name]
+            table = cls.__new__(cls)
+            for attr, item in state.items():
+                setattr(table, str(attr), self.decode(item, data))
+            return table
+
+        raise ValueError('unexpected value {!r}'.format(kind))
+
+
+class TTFStats(object):
+    'wall times of an export, to see where it spends its time.\n'
+    'pass one to TTFObject (or TTCObject) as stats; it then records the\n'
+    'time taken by each table parser, and for each glyph saved, the time\n'
+    'taken to decode, render and write it and the bytes written.'
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+        self.start = time.time()
+        self.tables = OrderedDict()
+        self.glyphs = []
+        self.decode_seconds = 0.0
+        self.decoded = {}
+
+    def add_table(self, tag, seconds):
+        self.tables[tag] = self.tables.get(tag, 0.0) + seconds
+
+    def add_decode(self, index, seconds):
+        # glyphs are often decoded ahead of being saved (see prefetch), so
+        # the time is kept until the glyph is saved
+        self.decode_seconds += seconds
+        self.decoded[index] = self.decoded.get(index, 0.0) + seconds
+
+    def add_glyph(self, font, index, render, write, size):
+        'records a glyph saved; returns the record, a tuple of\n'
+        '(font, index, decode, render, write, size).'
+        record = (
+            font, index, self.decoded.pop(index, 0.0), render, write, size,
+        )
+        self.glyphs.append(record)
+        return record
+
+    def add_write(self, seconds, record=-1):
+        'adds the time taken to write the glyph recorded at the position\n'
+        'record of glyphs, the last one by default.'
+        font, index, decode, render, write, size = self.glyphs[record]
+        self.glyphs[record] = (
+            font, index, decode, render, write + seconds, size,
+        )
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        decode = sum(record[2] for record in self.glyphs)
+        render = sum(record[3] for record in self.glyphs)
+        write = sum(record[4] for record in self.glyphs)
+        slowest = sorted(
+            self.glyphs, key=lambda record: -sum(record[2:5]),
+        )[:self.slowest]
+        return OrderedDict([
+            ('elapsed', elapsed),
+            ('tables', self.tables),
+            ('glyphs', len(self.glyphs)),
+            ('glyphs_per_sec', len(self.glyphs) / elapsed if elapsed else 0.0),
+            ('decode', decode),
+            ('render', render),
+            ('write', write),
+            # decoded but never saved, e.g. the components of composites
+            ('decode_other', sum(self.decoded.values(), 0.0)),
+            ('bytes', sum(record[5] for record in self.glyphs)),
+            ('slowest', [
+                OrderedDict(zip(
+                    ('font', 'index', 'decode', 'render', 'write', 'bytes'),
+                    record,
+                ))
+                for record in slowest
+            ]),
+        ])
+
+    def report(self, fout):
+        'writes a human-readable summary to fout, followed by a line of\n'
+        'JSON with the same numbers.'
+        summary = self.summary()
+        fout.write('Tables:\n')
+        for tag, seconds in summary['tables'].items():
+            fout.write('    {:<4} {:10.6f} s\n'.format(tag, seconds))
+        fout.write(
+            'Glyphs: {glyphs} in {elapsed:.3f} s '
+            '({glyphs_per_sec:.1f} glyphs/s), {bytes} bytes\n'
+            '    decode {decode:10.6f} s (+ {decode_other:.6f} s other)\n'
+            '    render {render:10.6f} s\n'
+            '    write  {write:10.6f} s\n'.format(**summary)
+        )
+        if summary['slowest']:
+            fout.write('Slowest glyphs:\n')
+        for record in summary['slowest']:
+            fout.write(
+                '    {font:>3} {index:>6} {decode:10.6f} {render:10.6f} '
+                '{write:10.6f} {bytes:>8}\n'.format(**record)
+            )
+        fout.write(json.dumps(summary) + '\n')
 
 
 class TTFTable(object):
@@ -162,14 +1317,14 @@ class TTFTable(object):
 
 class TTFHead(object):
     def __init__(self, ttf):
-        ttf.fin.seek(ttf.tables['head'].offset)
+        fin = ttf.table_stream('head')
 
-        self.version = fixed(ttf.fin.read(4))
-        self.font_revision = fixed(ttf.fin.read(4))
+        self.version = fixed(fin.read(4))
+        self.font_revision = fixed(fin.read(4))
         (
             self.check_sum_adjustment,
             self.magic_number,
-        ) = struct.unpack('>2I', ttf.fin.read(8))
+        ) = struct.unpack('>2I', fin.read(8))
         # 0x0001 - baseline(y)=0
         # 0x0002 - lsb(x)=0
         # 0x0004 - optical scl
@@ -178,9 +1333,9 @@ class TTFHead(object):
         (
             self.flags,
             self.units_per_em,
-        ) = struct.unpack('>2H', ttf.fin.read(4))
-        self.created = long_date_time(ttf.fin.read(8))
-        self.modified = long_date_time(ttf.fin.read(8))
+        ) = struct.unpack('>2H', fin.read(4))
+        self.created = long_date_time(fin.read(8))
+        self.modified = long_date_time(fin.read(8))
         (
             self.x_min, self.y_min,
             self.x_max, self.y_max,
@@ -189,13 +1344,13 @@ class TTFHead(object):
             self.font_direction_hint,
             self.index_to_loc_format,
             self.glyph_data_format,
-        ) = struct.unpack('>4h2H3h', ttf.fin.read(0x12))
+        ) = struct.unpack('>4h2H3h', fin.read(0x12))
 
 
 class TTFHHea(object):
     def __init__(self, ttf):
-        ttf.fin.seek(ttf.tables['hhea'].offset)
-        self.version = fixed(ttf.fin.read(4))
+        fin = ttf.table_stream('hhea')
+        self.version = fixed(fin.read(4))
         (
             self.ascent,
             self.descent,
@@ -207,18 +1362,18 @@ class TTFHHea(object):
             self.caret_slope_rise,
             self.caret_slope_run,
             self.caret_offset,
-        ) = struct.unpack('>3hH6h', ttf.fin.read(0x14))
-        self.reserved = struct.unpack('>4h', ttf.fin.read(8))
+        ) = struct.unpack('>3hH6h', fin.read(0x14))
+        self.reserved = struct.unpack('>4h', fin.read(8))
         (
             self.metric_data_format,
             self.num_of_long_hor_metrics,
-        ) = struct.unpack('>hH', ttf.fin.read(0x4))
+        ) = struct.unpack('>hH', fin.read(0x4))
 
 
 class TTFMaxP(object):
     def __init__(self, ttf):
-        ttf.fin.seek(ttf.tables['maxp'].offset)
-        self.version = fixed(ttf.fin.read(4))
+        fin = ttf.table_stream('maxp')
+        self.version = fixed(fin.read(4))
         (
             self.num_glyphs,
             self.max_points,
@@ -234,25 +1389,35 @@ class TTFMaxP(object):
             self.max_size_of_instructions,
             self.max_component_elements,
             self.max_component_depth,
-        ) = struct.unpack('>14H', ttf.fin.read(0x1c))
+        ) = struct.unpack('>14H', fin.read(0x1c))
 
 
 class TTFName(object):
     def __init__(self, ttf):
-        ttf.fin.seek(ttf.tables['name'].offset)
+        fin = ttf.table_stream('name')
         (
             self.format,
             self.count,
             self.string_offset,
-        ) = struct.unpack('>3H', ttf.fin.read(6))
+        ) = struct.unpack('>3H', fin.read(6))
 
         self.name_record_array = []
         for i in range(self.count):
-            name_record = TTFNameRecord(ttf.fin.read(0xc))
+            name_record = TTFNameRecord(fin.read(0xc))
             self.name_record_array.append(name_record)
 
+        # (platform_id, specific_id, language_id, name_id) -> record index
+        self.record_index = {}
+        for i, nr in enumerate(self.name_record_array):
+            self.record_index.setdefault(
+                (nr.platform_id, nr.specific_id, nr.language_id, nr.name_id),
+                i,
+            )
+
         string_length = ttf.tables['name'].length - self.string_offset
-        self.string = StringIO(ttf.fin.read(string_length))
+        self.string = ttf.reader.stream(
+            ttf.tables['name'].offset + self.string_offset, string_length
+        )
 
     def get_string(self, index):
         if not index < self.count:
@@ -262,6 +1427,24 @@ class TTFName(object):
         string = self.string.read(self.name_record_array[index].length)
         return string  #.encode('some_encoding')
 
+    def find(self, platform_id, specific_id, language_id, name_id):
+        key = (platform_id, specific_id, language_id, name_id)
+        if key not in self.record_index:
+            return ''
+
+        return self.get_string(self.record_index[key])
+
+    def find_text(self, name_id):
+        'the name as unicode, from the Windows (Unicode, English) record or\n'
+        'else the Macintosh (Roman, English) one; None without either.'
+        key = (3, 1, 0x409, name_id)
+        if key in self.record_index:
+            return self.find(*key).decode('utf_16_be', 'replace')
+        key = (1, 0, 0, name_id)
+        if key in self.record_index:
+            return self.find(*key).decode('mac_roman', 'replace')
+        return None
+
 class TTFNameRecord(object):
     def __init__(self, stream):
         (
@@ -276,7 +1459,7 @@ class TTFNameRecord(object):
 
 class TTFOS_2(object):
     def __init__(self, ttf):
-        ttf.fin.seek(ttf.tables['OS/2'].offset)
+        fin = ttf.table_stream('OS/2')
         (
             self.version,
             self.x_avg_char_width,
@@ -294,10 +1477,10 @@ class TTFOS_2(object):
             self.y_strikeout_size,
             self.y_strikeout_position,
             self.s_family_class,
-        ) = struct.unpack('>Hh2H12h', ttf.fin.read(0x20))
-        self.panose = struct.unpack('>10B', ttf.fin.read(0xa))
-        self.unicode_range = struct.unpack('>4I', ttf.fin.read(0x10))
-        self.ach_vend_id = ttf.fin.read(4)
+        ) = struct.unpack('>Hh2H12h', fin.read(0x20))
+        self.panose = struct.unpack('>10B', fin.read(0xa))
+        self.unicode_range = struct.unpack('>4I', fin.read(0x10))
+        self.ach_vend_id = fin.read(4)
         (
             self.fs_selection,
             self.fs_first_char_index,
@@ -307,28 +1490,30 @@ class TTFOS_2(object):
             self.s_typo_linegap,
             self.us_win_ascent,
             self.us_win_descent,
-        ) = struct.unpack('>3H3h2H', ttf.fin.read(0x10))
-        self.code_page_range = struct.unpack('>2I', ttf.fin.read(8))
-        (
-            self.sx_height,
-            self.s_cap_height,
-            self.us_default_char,
-            self.us_break_char,
-            self.us_max_context,
-        ) = struct.unpack('>2h3H', ttf.fin.read(0xa))
+        ) = struct.unpack('>3H3h2H', fin.read(0x10))
+        if self.version >= 1:
+            self.code_page_range = struct.unpack('>2I', fin.read(8))
+        if self.version >= 2:
+            (
+                self.sx_height,
+                self.s_cap_height,
+                self.us_default_char,
+                self.us_break_char,
+                self.us_max_context,
+            ) = struct.unpack('>2h3H', fin.read(0xa))
         if self.version >= 5.0:
             (
                 self.us_lower_point_size,
                 self.us_upper_point_size,
-            ) = struct.unpack('>2H', ttf.fin.read(4))
+            ) = struct.unpack('>2H', fin.read(4))
 
 
 class TTFPost(object):
     def __init__(self, ttf):
-        ttf.fin.seek(ttf.tables['post'].offset)
+        fin = ttf.table_stream('post')
 
-        self.version = fixed(ttf.fin.read(4))
-        self.italic_angle = fixed(ttf.fin.read(4))
+        self.version = fixed(fin.read(4))
+        self.italic_angle = fixed(fin.read(4))
         (
             self.underline_position,
             self.underline_thickness,
@@ -337,28 +1522,30 @@ class TTFPost(object):
             self.max_mem_type_42,
             self.min_mem_type_1,
             self.max_mem_type_1,
-        ) = struct.unpack('>2h5I', ttf.fin.read(0x18))
+        ) = struct.unpack('>2h5I', fin.read(0x18))
 
-        self.number_of_glyphs, = struct.unpack('>H', ttf.fin.read(2))
+        self.number_of_glyphs, = struct.unpack('>H', fin.read(2))
         if not self.number_of_glyphs == ttf.maxp.num_glyphs:
             raise ValueError
 
-        self.glyph_name_indices = []
-        self.number_new_glyphs = 0
-
-        for i in range(self.number_of_glyphs):
-            index, = struct.unpack('>H', ttf.fin.read(2))
-            self.glyph_name_indices.append(index)
-            if index > 257:
-                self.number_new_glyphs += 1
+        self.glyph_name_indices = big_endian_array(
+            'H', fin.read(2 * self.number_of_glyphs)
+        )
+        self.number_new_glyphs = sum(
+            1 for index in self.glyph_name_indices if index > 257
+        )
 
         if self.version == 1.0:
             pass
         elif self.version == 2.0:
+            # the names are pascal strings one after another
+            data = str(fin.read())
             ps_glyphs = []
+            pos = 0
             for i in range(self.number_new_glyphs):
-                name = pascal_string(ttf.fin)
-                ps_glyphs.append(name)
+                length = ord(data[pos])
+                ps_glyphs.append(data[pos+1:pos+1+length])
+                pos += 1 + length
 
             self.names = []
             for index in self.glyph_name_indices:
@@ -376,10 +1563,13 @@ class TTFPost(object):
 
 
 class TTFCMap(object):
+    # unicode subtables in order of preference
+    UNICODE_SUBTABLES = [
+        (3, 10), (0, 6), (0, 4), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0),
+    ]
+
     def __init__(self, ttf):
-        ttf.fin.seek(ttf.tables['cmap'].offset)
-        length = ttf.tables['cmap'].length
-        self.fin = StringIO(ttf.fin.read(length))
+        self.fin = ttf.table_stream('cmap')
         (
             self.version,
             self.number_subtables,
@@ -393,6 +1583,28 @@ class TTFCMap(object):
         for subtable in self.subtables:
             subtable.get_data()
 
+        # codepoint -> glyph index, from the best unicode subtable
+        self.unicode = None
+        subtables = dict(
+            ((st.platform_id, st.platform_specific_id), st)
+            for st in reversed(self.subtables) if st.runs is not None
+        )
+        for key in self.UNICODE_SUBTABLES:
+            if key in subtables:
+                self.unicode = TTFCMapIndex(subtables[key].runs)
+                break
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('fin', None)  # the table stream is not needed once parsed
+        return state
+
+    def glyph_index(self, codepoint):
+        if self.unicode is None:
+            return 0
+
+        return self.unicode.get(codepoint)
+
 class TTFCMapSubtable(object):
     def __init__(self, fin):
         self.fin = fin
@@ -402,7 +1614,16 @@ class TTFCMapSubtable(object):
             self.offset,
         ) = struct.unpack('>2HI', self.fin.read(8))
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('fin', None)
+        return state
+
     def get_data(self):
+        # runs of consecutive mappings as (first code, last code, glyph of
+        # the first code); None for formats not supported
+        self.runs = None
+
         self.fin.seek(self.offset)
         self.format, = struct.unpack('>H', self.fin.read(2))
         if self.format == 0:
@@ -410,23 +1631,67 @@ class TTFCMapSubtable(object):
                 self.length,
                 self.language,
             ) = struct.unpack('>2H', self.fin.read(4))
-            self.glyph_index_array = []
-            for i in range(256):
-                glyph_index, = struct.unpack('>B', self.fin.read(2))
-                self.glyph_index_array.append(glyph_index)
+            self.glyph_index_array = list(bytearray(self.fin.read(256)))
+            self.runs = cmap_runs(enumerate(self.glyph_index_array))
 
         elif self.format == 2:
             pass
         elif self.format == 4:
-            pass
+            (
+                self.length,
+                self.language,
+                seg_count_x2,
+                self.search_range,
+                self.entry_selector,
+                self.range_shift,
+            ) = struct.unpack('>6H', self.fin.read(0xc))
+            seg_count = seg_count_x2 // 2
+            fmt = '>{}H'.format(seg_count)
+            self.end_code = struct.unpack(fmt, self.fin.read(seg_count_x2))
+            self.reserved_pad, = struct.unpack('>H', self.fin.read(2))
+            self.start_code = struct.unpack(fmt, self.fin.read(seg_count_x2))
+            self.id_delta = struct.unpack(fmt, self.fin.read(seg_count_x2))
+            self.id_range_offset = struct.unpack(
+                fmt, self.fin.read(seg_count_x2)
+            )
+            # the glyph id array runs up to the end of the subtable
+            rest = self.fin.read(max(0, self.length - (0x10 + 8*seg_count)))
+            self.glyph_id_array = struct.unpack(
+                '>{}H'.format(len(rest) // 2), rest[:len(rest)//2*2]
+            )
+            self.runs = self._format_4_runs(seg_count)
+
         elif self.format == 6:
-            pass
+            (
+                self.length,
+                self.language,
+                self.first_code,
+                entry_count,
+            ) = struct.unpack('>4H', self.fin.read(8))
+            self.glyph_index_array = struct.unpack(
+                '>{}H'.format(entry_count), self.fin.read(2 * entry_count)
+            )
+            self.runs = cmap_runs(
+                (self.first_code + i, glyph)
+                for i, glyph in enumerate(self.glyph_index_array)
+            )
+
         elif self.format == 8.0:  # in Fixed32
             pass
         elif self.format == 10.0:
             pass
         elif self.format == 12.0:
-            pass
+            (
+                reserved,
+                self.length,
+                self.language,
+                num_groups,
+            ) = struct.unpack('>H3I', self.fin.read(0xe))
+            groups = struct.unpack(
+                '>{}I'.format(3 * num_groups), self.fin.read(0xc * num_groups)
+            )
+            self.runs = zip(groups[0::3], groups[1::3], groups[2::3])
+
         elif self.format == 13.0:
             pass
         elif self.format == 14:
@@ -434,132 +1699,468 @@ class TTFCMapSubtable(object):
         else:
             pass
 
+    def _format_4_runs(self, seg_count):
+        runs = []
+        for i in range(seg_count):
+            start = self.start_code[i]
+            end = self.end_code[i]
+            delta = self.id_delta[i]
+            range_offset = self.id_range_offset[i]
+            if start > end:
+                continue
+
+            if range_offset == 0:
+                glyph = (start + delta) & 0xffff
+                if glyph + (end - start) > 0xffff:  # wraps around to 0
+                    split = start + (0x10000 - glyph)
+                    runs.append((start, split - 1, glyph))
+                    start, glyph = split, 0
+                if glyph == 0:  # glyph 0 means unmapped
+                    start, glyph = start + 1, 1
+                if start <= end:
+                    runs.append((start, end, glyph))
+                continue
+
+            # index into glyph_id_array, as the spec's pointer arithmetic
+            base = i - seg_count + range_offset // 2
+            mapping = []
+            for code in range(start, end + 1):
+                j = base + (code - start)
+                if 0 <= j < len(self.glyph_id_array):
+                    glyph = self.glyph_id_array[j]
+                    if glyph:
+                        glyph = (glyph + delta) & 0xffff
+                else:
+                    glyph = 0
+                mapping.append((code, glyph))
+            runs.extend(cmap_runs(mapping))
+
+        return runs
+
+class TTFCMapIndex(object):
+    'codepoint to glyph index lookup.\n'
+    'keeps sorted runs of consecutive mappings in arrays and finds the run\n'
+    'of a codepoint by bisection.'
+    def __init__(self, runs):
+        self.starts = array('i')
+        self.ends = array('i')
+        self.glyphs = array('i')
+        for start, end, glyph in sorted(runs):
+            if self.ends and start <= self.ends[-1]:
+                continue  # overlapping segments; the first one wins
+            self.starts.append(start)
+            self.ends.append(end)
+            self.glyphs.append(glyph)
+
+    def __len__(self):
+        return sum(
+            end - start + 1 for start, end in zip(self.starts, self.ends)
+        )
+
+    def __contains__(self, codepoint):
+        return self.get(codepoint) != 0
+
+    def get(self, codepoint, default=0):
+        i = bisect.bisect_right(self.starts, codepoint) - 1
+        if i < 0 or codepoint > self.ends[i]:
+            return default
+
+        return self.glyphs[i] + (codepoint - self.starts[i])
+
+    def items(self, first=0, last=0x10ffff):
+        'yields (codepoint, glyph index) for the mapped codepoints in\n'
+        'first..last, walking only the runs that overlap the range.'
+        i = max(bisect.bisect_right(self.starts, first) - 1, 0)
+        while i < len(self.starts) and self.starts[i] <= last:
+            start = max(self.starts[i], first)
+            end = min(self.ends[i], last)
+            glyph = self.glyphs[i] + (start - self.starts[i])
+            for codepoint in range(start, end + 1):
+                if glyph:
+                    yield codepoint, glyph
+                glyph += 1
+            i += 1
+
 
 class TTFHMtx(object):
+    'advance_widths and left_side_bearings have an entry for each glyph;\n'
+    'the glyphs after the last long metric take its advance width and\n'
+    'their left side bearings from the array following the metrics.'
     def __init__(self, ttf):
-        ttf.fin.seek(ttf.tables['hmtx'].offset)
+        data = ttf.table_data('hmtx')
+
+        num_of_long_hor_metrics = ttf.hhea.num_of_long_hor_metrics
+        num_glyphs = max(ttf.maxp.num_glyphs, num_of_long_hor_metrics)
+        self.num_of_long_hor_metrics = num_of_long_hor_metrics
+
+        metrics = data[:4 * num_of_long_hor_metrics]
+        self.advance_widths = big_endian_array('H', metrics)[0::2]
+        self.left_side_bearings = big_endian_array('h', metrics)[1::2]
+
+        num_lsbs = num_glyphs - num_of_long_hor_metrics
+        self.left_side_bearings.extend(big_endian_array(
+            'h',
+            data[4 * num_of_long_hor_metrics:][:2 * num_lsbs],
+        ))
+        if self.advance_widths:
+            self.advance_widths.extend(
+                self.advance_widths[-1:] * num_lsbs
+            )
 
-        self.h_metrics = []
-        for i in range(ttf.hhea.num_of_long_hor_metrics):
-            long_hor_metric = TTFHMtxHMetric(ttf.fin.read(4))
-            self.h_metrics.append(long_hor_metric)
+    @property
+    def h_metrics(self):
+        'the long metrics as TTFHMtxHMetric objects.'
+        return [
+            TTFHMtxHMetric(
+                self.advance_widths[i], self.left_side_bearings[i],
+            )
+            for i in range(self.num_of_long_hor_metrics)
+        ]
 
 class TTFHMtxHMetric(object):
-    def __init__(self, stream):
-        (
-            self.advance_width,
-            self.left_side_bearing,
-        ) = struct.unpack('>Hh', stream)
+    __slots__ = ('advance_width', 'left_side_bearing')
+
+    def __init__(self, advance_width, left_side_bearing):
+        self.advance_width = advance_width
+        self.left_side_bearing = left_side_bearing
 
 
 class TTFLoca(object):
     def __init__(self, ttf):
-        ttf.fin.seek(ttf.tables['loca'].offset)
+        data = ttf.table_data('loca')
 
         num_glyphs = ttf.maxp.num_glyphs
         index_to_loc_format = ttf.head.index_to_loc_format
 
-        self.offsets = []
+        # offsets are kept signed so that they read back as ints; the glyf
+        # table is never anywhere near 2 GB
+        self.offsets = array('i')
         if index_to_loc_format == 0:
-            for i in range(num_glyphs+1):
-                offset = 2 * struct.unpack('>H', ttf.fin.read(2))[0]
-                self.offsets.append(offset)
+            self.offsets.extend(
+                offset << 1
+                for offset in big_endian_array('H', data[:2*num_glyphs+2])
+            )
 
         elif index_to_loc_format == 1:
-            for i in range(num_glyphs+1):
-                offset, = struct.unpack('>I', ttf.fin.read(4))
-                self.offsets.append(offset)
+            self.offsets = big_endian_array('i', data[:4*num_glyphs+4])
 
 
 class TTFGlyf(object):
-    def __init__(self, ttf):
-        ttf.fin.seek(ttf.tables['glyf'].offset)
-        offsets = ttf.loca.offsets
+    def __init__(self, ttf, cache_size=1024, outline_cache_size=1024):
+        self.glyphs = TTFGlyfGlyphs(ttf, cache_size=cache_size)
+        # flattened outlines of glyphs used as components, in font units
+        self.outline_cache = LRUCache(outline_cache_size)
+
+    def outline(self, index):
+        'returns the glyph as a list of paths in font units.\n'
+        'each path is a list of (flags, points) contours; a composite glyph\n'
+        'has one path per simple glyph it is made of.'
+        if not index < len(self.glyphs):
+            return [[]]
 
-        self.glyphs = []
-        for i, offset in enumerate(offsets[:-1]):
-            length = offsets[i+1] - offset
-            stream = StringIO(ttf.fin.read(length))
-            if length:
-                glyph = TTFGlyfGlyph(stream)
-                self.glyphs.append(glyph)
-            else:
-                self.glyphs.append(None)
+        glyph = self.glyphs[index]
+        if glyph is None:
+            return [[]]
+
+        if glyph.glyph_type == 'simple':
+            contours = []
+            start = 0
+            for end in glyph.end_pts_of_contours:
+                contours.append((
+                    glyph.flags[start:end+1],
+                    zip(
+                        glyph.x_coordinates[start:end+1],
+                        glyph.y_coordinates[start:end+1],
+                    ),
+                ))
+                start = end + 1
+
+            return [contours]
+
+        paths = []
+        for component in glyph.components:
+            component_paths = self.component_outline(component.glyph_index)
+            (a, b), (c, d) = component.matrix
+            e, f = component.arg1, component.arg2  # XXX
+            if component.flag & 0x1800 == 0x0800:
+                # scaled component offset: the offset is transformed by
+                # the matrix too; unscaled (0x1000) unless the flag is set
+                e, f = a*e + b*f, c*e + d*f
+            if (a, b, c, d, e, f) == (1.0, 0.0, 0.0, 1.0, 0, 0):
+                paths.extend(component_paths)
+                continue
+
+            for path in component_paths:
+                paths.append([
+                    (
+                        flags,
+                        [(a*x + b*y + e, c*x + d*y + f) for x, y in points],
+                    )
+                    for flags, points in path
+                ])
+
+        return paths
+
+    def component_outline(self, index):
+        paths = self.outline_cache.get(index)
+        if paths is None:
+            paths = self.outline(index)
+            self.outline_cache.put(index, paths)
+
+        return paths
 
     def draw_line(
             self, index,
             matrix=[[1.0, 0.0], [0.0, 1.0]],
             offset=[0.0, 0.0],
             scale=0.5,
+            write=None,
+            precision=None,
+            compact=False,
     ):
+        'writes the <path> elements of the glyph piece by piece to write,\n'
+        'e.g. fout.write or list.append; returns them as a string if None.\n'
+        'precision and compact are as for calc_path.'
+        if write is None:
+            chunks = []
+            self.draw_line(
+                index, matrix, offset, scale, chunks.append,
+                precision, compact,
+            )
+            return ''.join(chunks)
+
         if not index < len(self.glyphs):
-            return ''
+            return
 
-        if self.glyphs[index] is None:
-            return ''
+        glyph = self.glyphs[index]
+        if glyph is None:
+            return
 
         (a, b), (c, d) = matrix
+        a, b, c, d = [scale * i for i in (a, b, c, d)]
+        x0, y0 = offset
+        x0, y0 = [
+            a*x0 + b*y0,
+            c*x0 + d*y0,
+        ]
+
+        for path in self.outline(index):
+            if path:
+                if compact:
+                    write(
+                        '<path stroke="black" stroke-width="2" '
+                        'fill="evenodd" d="'
+                    )
+                else:
+                    write(
+                        '    <path\n'
+                        '        stroke="black"\n'
+                        '        stroke-width="2"\n'
+                        '        fill="evenodd"\n'
+                        '        d="\n'
+                    )
+                for flags, points in path:
+                    coordinates = [
+                        (x0 + (a * x) + (b * y), y0 - ((c * x) + (d * y)))
+                        for x, y in points
+                    ]
+                    calc_path(
+                        flags, coordinates, matrix, write, precision, compact,
+                    )
 
-        glyph = self.glyphs[index]
-        if glyph.glyph_type == 'composite':
-            string = ''
-            for component in glyph.components:
-                c_index = component.glyph_index
-                z, w = component.arg1, component.arg2  # XXX
-                z, w = [
-                    a*z + b*w,
-                    c*z + d*w,
-                ]
-                (s, t), (u, v) = component.matrix
-                mat = [
-                    [a*s + b*u, a*t + b*v],
-                    [c*s + d*u, c*t + d*v],
-                ]
-                string += self.draw_line(
-                    c_index,
-                    matrix=mat,
-                    offset=[z, -w],
-                    scale=scale,
-                ) + '\n'
-
-
-        elif glyph.glyph_type == 'simple':
-            contours = [[[], []]]
-            a, b, c, d = [scale * i for i in (a, b, c, d)]
-            x, y = offset
-            x, y = [
-                a*x + b*y,
-                c*x + d*y,
-            ]
-            for index, (flag, coordinate), in enumerate(
-                zip(glyph.flags, glyph.coordinates)
-            ):
-                contours[-1][0].append(flag)
-
-                dx, dy = coordinate
-                x += (a * dx) + (b * dy)
-                y -= (c * dx) + (d * dy)
-                contours[-1][1].append((x, y))
-
-                if glyph.end_pts_of_contours[len(contours)-1] == index:
-                    contours.append([[], []])
-
-            string = (
-                '    <path\n'
-                '        stroke="black"\n'
-                '        stroke-width="2"\n'
-                '        fill="evenodd"\n'
-                '        d="\n'
+                if compact:
+                    write('"/>')
+                else:
+                    write(' ' * 8 + '"\n' + ' ' * 4 + '/>')
+
+            if glyph.glyph_type == 'composite' and not compact:
+                write('\n')
+
+class TTFGlyfGlyphs(object):
+    'index-addressable view of the glyphs; decodes each glyph on demand.\n'
+    'cache_size - number of decoded glyphs to keep (None: unbounded, 0: none)'
+    def __init__(self, ttf, cache_size=1024):
+        self.reader = ttf.reader
+        self.glyf_offset = ttf.tables['glyf'].offset
+        self.offsets = ttf.loca.offsets
+        self.cache = LRUCache(cache_size)
+        self.stats = ttf.stats
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('glyph index out of range')
+
+        if index in self.cache:
+            return self.cache.get(index)
+
+        glyph = self.decode(index)
+        self.cache.put(index, glyph)
+        return glyph
+
+    def decode(self, index, block=None, block_offset=0):
+        if self.stats is not None:
+            start = time.time()
+            glyph = self._decode(index, block, block_offset)
+            self.stats.add_decode(index, time.time() - start)
+            return glyph
+
+        return self._decode(index, block, block_offset)
+
+    def _decode(self, index, block=None, block_offset=0):
+        offset = self.offsets[index]
+        length = self.offsets[index+1] - offset
+        if not length:
+            return None
+
+        if block is not None:
+            return TTFGlyfGlyph(
+                TTFStream(buffer(block, offset - block_offset, length))
             )
-            for flags, coordinates in contours[:-1]:
-                string += calc_path(flags, coordinates, matrix)
+
+        return TTFGlyfGlyph(
+            self.reader.stream(self.glyf_offset + offset, length)
+        )
+
+    def sort_by_offset(self, indices):
+        'sorts glyph indices by where the glyphs are in the glyf table;\n'
+        'indices out of range go last.'
+        end = self.offsets[-1] + 1
+        return sorted(
+            indices,
+            key=lambda i: (self.offsets[i] if 0 <= i < len(self) else end, i),
+        )
+
+    def size(self, index):
+        'the length of the glyph record in bytes, 0 for an empty glyph.'
+        return self.offsets[index+1] - self.offsets[index]
+
+    def headers(self, indices):
+        'yields (number_of_contours, x_min, y_min, x_max, y_max) of each\n'
+        'glyph in indices, read from the first 10 bytes of its record;\n'
+        'all 0 for an empty glyph.'
+        data = self.reader.slice(self.glyf_offset, self.offsets[-1])
+        header = struct.Struct('>5h')
+        for index in indices:
+            if self.size(index):
+                yield header.unpack_from(data, self.offsets[index])
             else:
-                string += ' ' * 8 + '"\n'
-                string += ' ' * 4 + '/>'
+                yield (0, 0, 0, 0, 0)
 
-        return string
+    def raw(self, index):
+        'the glyph record as stored in the glyf table, without decoding it.'
+        return self.reader.slice(
+            self.glyf_offset + self.offsets[index], self.size(index)
+        )
+
+    def duplicates(self, indices):
+        'finds the glyphs whose records are byte-identical to that of an\n'
+        'earlier glyph in indices; returns {index: earlier index}.\n'
+        'the records are compared by their SHA-1, empty glyphs all alike.'
+        digests = {}
+        originals = {}
+        duplicates = {}
+        for index in indices:
+            if not 0 <= index < len(self):
+                continue
+
+            offset = self.offsets[index]
+            length = self.size(index)
+            key = ''
+            if length:
+                # glyphs sharing a record need not hash it again
+                key = digests.get((offset, length))
+                if key is None:
+                    key = hashlib.sha1(self.raw(index)).digest()
+                    digests[offset, length] = key
+
+            if key in originals:
+                duplicates[index] = originals[key]
+            else:
+                originals[key] = index
+
+        return duplicates
+
+    def prefetch(self, indices, max_gap=0x1000, max_length=1 << 20):
+        'reads the glyphs in offset order, coalescing nearby glyphs into one\n'
+        'read of at most max_length bytes, and decodes them into the cache.\n'
+        'yields the indices of each block once it is in the cache.'
+        indices = self.sort_by_offset(indices)
+        # leave room in the cache for the components of composite glyphs
+        max_count = self.cache.maxsize
+        if max_count is not None:
+            max_count //= 2
+        if max_count == 0:
+            for index in indices:
+                yield [index]
+            return
+
+        block = []
+        for index in indices:
+            if not 0 <= index < len(self):
+                if block:
+                    yield self._read_block(block)
+                    block = []
+                yield [index]
+                continue
+
+            if block:
+                start = self.offsets[block[0]]
+                last = self.offsets[block[-1]+1]
+                if (
+                    self.offsets[index] - last > max_gap
+                    or self.offsets[index+1] - start > max_length
+                    or (max_count is not None and len(block) >= max_count)
+                ):
+                    yield self._read_block(block)
+                    block = []
+
+            block.append(index)
+
+        if block:
+            yield self._read_block(block)
+
+    def _read_block(self, block):
+        start = self.offsets[block[0]]
+        end = max(self.offsets[i+1] for i in block)
+        data = self.reader.slice(self.glyf_offset + start, end - start)
+        for index in block:
+            if index not in self.cache:
+                self.cache.put(index, self.decode(index, data, start))
+
+        return block
 
 class TTFGlyfGlyph(object):
+    'a decoded glyph.  the points of a simple glyph are kept in arrays,\n'
+    'a byte per flag and 16 bits per coordinate, rather than as lists of\n'
+    'Python objects; coordinates pairs them up on demand.'
+    __slots__ = (
+        'number_of_contours',
+        'x_min',
+        'y_min',
+        'x_max',
+        'y_max',
+        'glyph_type',
+        'end_pts_of_contours',
+        'instruction_length',
+        'instructions',
+        'flags',
+        'x_coordinates',
+        'y_coordinates',
+        'components',
+    )
+
     def __init__(self, fin):
         (
             self.number_of_contours,
@@ -576,56 +2177,34 @@ class TTFGlyfGlyph(object):
 
 
         if self.glyph_type == 'simple':
-            self.end_pts_of_contours = struct.unpack(
-                '>{0}H'.format(self.number_of_contours),
-                fin.read(2 * self.number_of_contours)
+            self.end_pts_of_contours = big_endian_array(
+                'H', fin.read(2 * self.number_of_contours)
             )
             self.instruction_length, = struct.unpack('>H', fin.read(2))
             self.instructions = fin.read(self.instruction_length)  # TODO
 
-            self.flags = []
-            while len(self.flags) < self.end_pts_of_contours[-1] + 1:
-                flag, = struct.unpack('>B', fin.read(1))
-                self.flags.append(flag)
-                if flag & 0x08:  # repeat
-                    repeat_count, = struct.unpack('>B', fin.read(1))
-                    self.flags.extend([flag] * repeat_count)
-
-            self.x_coordinates = []
-            for flag in self.flags:
-                if flag & 0x02:  # x-short vector
-                    x, = struct.unpack('>B', fin.read(1))
-                    if not flag & 0x10:  # (not) positive x-short vector
-                        x *= -1
-                else:
-                    if flag & 0x10:  # this x is same
-                        x = 0
-                    else:
-                        x, = struct.unpack('>h', fin.read(2))
-
-                self.x_coordinates.append(x)
-
-            self.y_coordinates = []
-            for flag in self.flags:
-                if flag & 0x04:  # y-short vector
-                    y, = struct.unpack('>B', fin.read(1))
-                    if not flag & 0x20:  # (not) positive y-short vector
-                        y *= -1
-                else:
-                    if flag & 0x20:  # this y is same
-                        y = 0
-                    else:
-                        y, = struct.unpack('>h', fin.read(2))
+            if self.end_pts_of_contours:
+                number_of_points = self.end_pts_of_contours[-1] + 1
+            else:
+                number_of_points = 0
 
-                self.y_coordinates.append(y)
+            # coordinates are absolute, i.e. the running sums of the deltas
+            start = fin.tell()
+            data = fin.read()
+            (
+                self.flags,
+                x_coordinates,
+                y_coordinates,
+                end,
+            ) = decode_points(data, number_of_points)
 
-            self.coordinates = zip(
-                self.x_coordinates, self.y_coordinates
-            )
+            self.x_coordinates = coordinate_array(x_coordinates)
+            self.y_coordinates = coordinate_array(y_coordinates)
 
-            self.remainder = fin.read()
-            if self.remainder.strip('\x00'):
-                print 'XXX', `self.remainder`
+            fin.seek(start + end)
+            remainder = fin.read()
+            if remainder.strip('\x00'):
+                print 'XXX', `remainder`
 
         elif self.glyph_type == 'composite':
             self.components = []
@@ -635,7 +2214,13 @@ class TTFGlyfGlyph(object):
                 self.components.append(component)
                 more_components = component.flag & 0x0020
 
+    @property
+    def coordinates(self):
+        return zip(self.x_coordinates, self.y_coordinates)
+
 class TTFGlyfComponent(object):
+    __slots__ = ('flag', 'glyph_index', 'arg1', 'arg2', 'matrix')
+
     def __init__(self, fin):
         (
             self.flag,
@@ -670,6 +2255,83 @@ class TTFGlyfComponent(object):
         self.matrix = [[a, b], [c, d]]
 
 
+class LRUCache(object):
+    'least-recently-used cache with hit/miss counters.\n'
+    'maxsize - number of entries to keep (None: unbounded, 0: none)'
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        value = self.entries.pop(key)  # re-inserted as most recent
+        self.entries[key] = value
+        return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if self.maxsize is not None:
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+def cmap_runs(mapping):
+    'groups (code, glyph) pairs in code order into runs of consecutive\n'
+    'mappings, (first code, last code, glyph of the first code), skipping\n'
+    'unmapped codes.'
+    runs = []
+    for code, glyph in mapping:
+        if not glyph:
+            continue
+        if runs:
+            start, end, first = runs[-1]
+            if code == end + 1 and glyph == first + (code - start):
+                runs[-1] = (start, code, first)
+                continue
+        runs.append((code, code, glyph))
+
+    return runs
+
+def big_endian_array(typecode, data):
+    'reads data as an array of big-endian integers in one go; a trailing\n'
+    'partial item is ignored.'
+    values = array(typecode)
+    data = data[:len(data) - len(data) % values.itemsize]
+    values.fromstring(data)
+    if _LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+def int32_array(values):
+    'values as an array of 32-bit ints, or None if any of them is not an\n'
+    'int in that range.'
+    values = list(values)
+    for value in values:
+        if not (
+            type(value) in (int, long) and -0x80000000 <= value < 0x80000000
+        ):
+            return None
+    return array('i', values)
+
 def fixed(uint32_t):
     return struct.unpack('>i', uint32_t)[0] / 65536.0
 
@@ -681,14 +2343,313 @@ def long_date_time(uint64_t):
     time = (datetime.datetime(1904, 1, 1) + datetime.timedelta(0, seconds))
     return time.timetuple()[:6]
 
+# number of bytes a coordinate takes in the x (y) stream, indexed by flag
+_X_SIZES = ''.join(
+    chr(1 if f & 0x02 else (0 if f & 0x10 else 2)) for f in range(256)
+)
+_Y_SIZES = ''.join(
+    chr(1 if f & 0x04 else (0 if f & 0x20 else 2)) for f in range(256)
+)
+
+# below this, the set-up cost of NumPy outweighs what it saves
+_NUMPY_MIN_POINTS = 128
+
+def decode_points(data, number_of_points):
+    'decodes the flags and coordinates of a simple glyph.\n'
+    'returns (flags, x_coordinates, y_coordinates, end), where flags is a\n'
+    'bytearray, the coordinates are absolute and end is the offset just\n'
+    'past them.'
+    data = bytearray(data)
+
+    # only the flag bytes need a sequential scan; repeats are expanded
+    # in bulk
+    flags = bytearray()
+    pos = 0
+    while len(flags) < number_of_points:
+        flag = data[pos]
+        if flag & 0x08:  # repeat
+            flags.extend(chr(flag) * (data[pos+1] + 1))
+            pos += 2
+        else:
+            flags.append(flag)
+            pos += 1
+
+    # the sizes of both coordinate streams follow from the flags alone
+    x_start = pos
+    y_start = x_start + sum(bytearray(str(flags).translate(_X_SIZES)))
+    end = y_start + sum(bytearray(str(flags).translate(_Y_SIZES)))
+
+    if numpy is not None and len(flags) >= _NUMPY_MIN_POINTS:
+        data = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.int32)
+        flags_ = numpy.frombuffer(flags, dtype=numpy.uint8)
+        x_coordinates = _decode_deltas_numpy(data, x_start, flags_, 0x02, 0x10)
+        y_coordinates = _decode_deltas_numpy(data, y_start, flags_, 0x04, 0x20)
+    else:
+        x_coordinates = _decode_deltas(data, x_start, flags, 0x02, 0x10)
+        y_coordinates = _decode_deltas(data, y_start, flags, 0x04, 0x20)
+
+    return flags, x_coordinates, y_coordinates, end
+
+def _decode_deltas(data, pos, flags, short, same):
+    coordinates = []
+    value = 0
+    for flag in flags:
+        if flag & short:  # short vector
+            if flag & same:  # positive short vector
+                value += data[pos]
+            else:
+                value -= data[pos]
+            pos += 1
+        elif not flag & same:  # (not) this is same
+            delta = data[pos] << 8 | data[pos+1]
+            if delta & 0x8000:
+                delta -= 0x10000
+            value += delta
+            pos += 2
+
+        coordinates.append(value)
+
+    return coordinates
+
+def _decode_deltas_numpy(data, pos, flags, short, same):
+    is_short = (flags & short) != 0
+    is_same = (flags & same) != 0
+    sizes = numpy.where(is_short, 1, numpy.where(is_same, 0, 2))
+    offsets = pos + numpy.cumsum(sizes) - sizes
+
+    # zero-sized entries may point past the stream; their bytes are unused
+    last = len(data) - 1
+    high = data[numpy.minimum(offsets, last)]
+    low = data[numpy.minimum(offsets + 1, last)]
+
+    words = (high << 8) | low
+    words -= (words & 0x8000) << 1
+    deltas = numpy.where(
+        is_short,
+        numpy.where(is_same, high, -high),
+        numpy.where(is_same, 0, words),
+    )
+    return numpy.cumsum(deltas).tolist()
+
+def coordinate_array(coordinates):
+    'packs coordinates into an array of 16-bit integers, or of 32-bit\n'
+    'ones in the unlikely case that they do not fit.'
+    try:
+        return array('h', coordinates)
+    except OverflowError:
+        return array('i', coordinates)
+
+def flatten_contour(flags, points, steps=4):
+    'turns a contour into a polygon, following the same rules for on\n'
+    'and off curve points as calc_path, with each quadratic curve split\n'
+    'into steps line segments.  returns the vertices as a list of (x, y).'
+    if not points:
+        return []
+
+    # make the on curve points implied between two off curve points
+    # explicit, so that each curve has a single control point
+    nodes = []
+    for i, point in enumerate(points):
+        if not flags[i] & 0x01 and not flags[i-1] & 0x01:
+            (x0, y0), (x1, y1) = points[i-1], point
+            nodes.append((True, ((x0+x1)/2.0, (y0+y1)/2.0)))
+        nodes.append((bool(flags[i] & 0x01), point))
+
+    start = [on for on, point in nodes].index(True)
+    nodes = nodes[start:] + nodes[:start+1]
+
+    ts = [float(i) / steps for i in range(1, steps+1)]
+    last = nodes[0][1]
+    vertices = [last]
+    control = None
+    for on, point in nodes[1:]:
+        if not on:
+            control = point
+            continue
+
+        if control is None:
+            vertices.append(point)
+        else:
+            (x0, y0), (x1, y1), (x2, y2) = last, control, point
+            for t in ts:
+                u = 1.0 - t
+                vertices.append((
+                    u*u*x0 + 2*u*t*x1 + t*t*x2,
+                    u*u*y0 + 2*u*t*y1 + t*t*y2,
+                ))
+            control = None
+        last = point
+
+    return vertices
+
+def rasterize(polygons, width, height):
+    'fills polygons, lists of (x, y) vertices in pixels, with the even-odd\n'
+    'rule, sampling each pixel at its center.  returns a height x width\n'
+    'NumPy array of 0 (outside) and 1 (inside).'
+    edges = [
+        numpy.hstack([polygon, numpy.roll(polygon, -1, axis=0)])
+        for polygon in (
+            numpy.array(polygon, dtype=float) for polygon in polygons
+            if len(polygon) > 1
+        )
+    ]
+    if not edges:
+        return numpy.zeros((height, width), numpy.uint8)
+
+    x0, y0, x1, y1 = numpy.vstack(edges).T
+
+    # where each edge crosses the scanline through the centers of a row;
+    # an edge covers [min(y0, y1), max(y0, y1)), so horizontal edges and
+    # vertices shared by two edges are counted right
+    ys = numpy.arange(height) + 0.5
+    crossing = (
+        (ys >= numpy.minimum(y0, y1)[:, None])
+        & (ys < numpy.maximum(y0, y1)[:, None])
+    )
+    edge, row = numpy.nonzero(crossing)
+    x = x0[edge] + (ys[row] - y0[edge]) * (
+        (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    )
+
+    # each crossing flips the pixels whose centers are right of it; the
+    # running parity along a row tells which are inside
+    column = numpy.clip(numpy.ceil(x - 0.5), 0, width).astype(int)
+    flips = numpy.bincount(
+        row * (width + 1) + column, minlength=height * (width + 1)
+    ).reshape(height, width + 1)[:, :width]
+    return (numpy.cumsum(flips, axis=1) & 1).astype(numpy.uint8)
+
+# the columns of TTFObject.metrics(), with their typecodes
+_METRIC_COLUMNS = (
+    ('index', 'H'),
+    ('advance_width', 'H'),
+    ('left_side_bearing', 'h'),
+    ('number_of_contours', 'h'),
+    ('x_min', 'h'),
+    ('y_min', 'h'),
+    ('x_max', 'h'),
+    ('y_max', 'h'),
+)
+
+def save_metrics(filename, columns):
+    'writes an OrderedDict of equally long arrays, e.g. from metrics(),\n'
+    'as a CSV file with a header line if filename ends with .csv, and\n'
+    'otherwise as the columns one after the other, little-endian, with\n'
+    'a JSON index next to it giving the offset and NumPy dtype of each.'
+    names = list(columns)
+    if filename.endswith('.csv'):
+        with open(filename, 'w') as fout:
+            fout.write(','.join(names) + '\n')
+            for row in itertools.izip(*columns.values()):
+                fout.write(','.join(map(str, row)) + '\n')
+        return
+
+    index = []
+    offset = 0
+    with open(filename, 'wb') as fout:
+        for name in names:
+            column = columns[name]
+            if not _LITTLE_ENDIAN:
+                column = array(column.typecode, column)
+                column.byteswap()
+            fout.write(column.tostring())
+            index.append({
+                'name': name,
+                'dtype': '<{}{}'.format(
+                    'u' if column.typecode.isupper() else 'i',
+                    column.itemsize,
+                ),
+                'offset': offset,
+            })
+            offset += column.itemsize * len(column)
+
+    indexname = os.path.splitext(filename)[0] + '.json'
+    with open(indexname, 'w') as fout:
+        json.dump({
+            'data': os.path.basename(filename),
+            'count': len(columns[names[0]]) if names else 0,
+            'columns': index,
+        }, fout, sort_keys=True)
+
+def write_pgm(fout, image):
+    'writes a 2D NumPy array of uint8 grays as a binary PGM.'
+    height, width = image.shape
+    fout.write('P5\n{} {}\n255\n'.format(width, height))
+    fout.write(image.tostring())
+
+def write_png(fout, image):
+    'writes a 2D NumPy array of uint8 grays as an 8-bit grayscale PNG.'
+    def chunk(tag, data):
+        return (
+            struct.pack('>I', len(data)) + tag + data
+            + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+        )
+
+    height, width = image.shape
+    # each row starts with its filter type, 0 (none)
+    rows = numpy.hstack([numpy.zeros((height, 1), numpy.uint8), image])
+    fout.write('\x89PNG\r\n\x1a\n')
+    fout.write(chunk(
+        'IHDR', struct.pack('>2I5B', width, height, 8, 0, 0, 0, 0)
+    ))
+    fout.write(chunk('IDAT', zlib.compress(rows.tostring(), 6)))
+    fout.write(chunk('IEND', ''))
+
 def pascal_string(fin):
     length = ord(fin.read(1))
     return fin.read(length)
 
-def calc_path(flags, coordinates, matrix):
+def calc_path(
+        flags, coordinates, matrix,
+        write=None,
+        precision=None,
+        compact=False,
+):
+    'writes the path commands of a contour one by one to write;\n'
+    'returns them as a string if write is None.\n'
+    'precision - digits after the decimal point (None: as many as needed)\n'
+    'compact - writes relative commands without indentation or newlines'
+    if write is None:
+        chunks = []
+        calc_path(
+            flags, coordinates, matrix, chunks.append, precision, compact,
+        )
+        return ''.join(chunks)
+
+    commands = path_commands(flags, coordinates)
+
+    if compact:
+        write(compact_path(commands, precision))
+        return
+
+    if precision is None:
+        for command, args in commands:
+            write(_PATH_FORMATS[command].format(*args))
+        return
+
+    unit = 10.0 ** precision
+    for command, args in commands:
+        line = _PATH_FORMATS[command].format(
+            *[int(round(a * unit)) / unit for a in args]
+        )
+        # whole numbers lose their '.0'
+        write(line.replace('.0 ', ' ').replace('.0\n', '\n'))
+
+# '{}' formats a float as str() does
+_PATH_FORMATS = {
+    'M': ' ' * 0xc + 'M {} {}\n',
+    'L': ' ' * 0xc + 'L {} {}\n',
+    'Q': ' ' * 0xc + 'Q {} {} {} {}\n',
+    'T': ' ' * 0xc + 'T {} {}\n',
+    'z': ' ' * 0xc + 'z\n',
+}
+
+def path_commands(flags, coordinates):
+    'returns the path commands of a contour as a list of\n'
+    '(command, coordinates), e.g. (\'Q\', (x1, y1, x2, y2)), in absolute\n'
+    'coordinates, ending with (\'z\', ()).'
+    commands = []
     l = len(flags)
-    string = ' ' * 0xc
-    (a, b), (c, d) = matrix
 
     for i, f in enumerate(flags):
         x1, y1 = coordinates[(i+1)%l]
@@ -711,54 +2672,105 @@ def calc_path(flags, coordinates, matrix):
 
         if i == 0:
             if f & 0x01:  # on curve
-                x, y = coordinates[i]
-                string += 'M {} {}\n'.format(x, y)
-                string += ' ' * 0xc
+                commands.append(('M', coordinates[i]))
                 if f1 & 0x01:
-                    string += 'L {} {}\n'.format(x1, y1)
+                    commands.append(('L', (x1, y1)))
                 elif f2 & 0x01:
-                    string += 'Q {} {} {} {}\n'.format(x1, y1, x2, y2)
+                    commands.append(('Q', (x1, y1, x2, y2)))
                 else:
-                    string += 'Q {} {} {} {}\n'.format(
-                        x1, y1, (x1+x2)/2.0, (y1+y2)/2.0
+                    commands.append(
+                        ('Q', (x1, y1, (x1+x2)/2.0, (y1+y2)/2.0))
                     )
             else:
                 if f1 & 0x01:
-                    string += 'M {} {}\n'.format(x1, y1)
+                    commands.append(('M', (x1, y1)))
                 elif f2 & 0x01:
                     x, y = coordinates[i]
-                    string += 'M {} {}\n'.format((x+x1)/2.0, (y+y1)/2.0)
-                    string += ' ' * 0xc
-                    string += 'Q {} {} {} {}\n'.format(x1, y1, x2, y2)
+                    commands.append(('M', ((x+x1)/2.0, (y+y1)/2.0)))
+                    commands.append(('Q', (x1, y1, x2, y2)))
                 else:
                     x, y = coordinates[i]
-                    string += 'M {} {}\n'.format((x+x1)/2.0, (y+y1)/2.0)
-                    string += ' ' * 0xc
-                    string += 'Q {} {} {} {}\n'.format(
-                        x1, y1, (x1+x2)/2.0, (y1+y2)/2.0
+                    commands.append(('M', ((x+x1)/2.0, (y+y1)/2.0)))
+                    commands.append(
+                        ('Q', (x1, y1, (x1+x2)/2.0, (y1+y2)/2.0))
                     )
             continue
 
         if f & 0x01:
-            string += ' ' * 0xc
             if f1 & 0x01:
-                string += 'L {} {}\n'.format(x1, y1)
+                commands.append(('L', (x1, y1)))
             elif f2 & 0x01:
-                string += 'Q {} {} {} {}\n'.format(x1, y1, x2, y2)
+                commands.append(('Q', (x1, y1, x2, y2)))
             else:
-                string += 'Q {} {} {} {}\n'.format(x1, y1, (x1+x2)/2.0, (y1+y2)/2.0)
+                commands.append(('Q', (x1, y1, (x1+x2)/2.0, (y1+y2)/2.0)))
         elif f1 & 0x01:
             continue
         elif f2 & 0x01:
-            string += ' ' * 0xc
-            string += 'T {} {}\n'.format(x2, y2)
+            commands.append(('T', (x2, y2)))
         else:
-            string += ' ' * 0xc
-            string += 'Q {} {} {} {}\n'.format(x1, y1, (x1+x2)/2.0, (y1+y2)/2.0)
+            commands.append(('Q', (x1, y1, (x1+x2)/2.0, (y1+y2)/2.0)))
     else:
-        string += ' ' * 0xc + 'z\n'
-
-    return string
+        commands.append(('z', ()))
+
+    return commands
+
+def compact_path(commands, precision=None):
+    'formats path commands as compactly as SVG allows: relative commands\n'
+    'after the initial moveto, a command letter only where it changes and\n'
+    'no whitespace that is not needed.  the points are rounded before the\n'
+    'deltas are taken, so that rounding errors do not add up.'
+    # with a precision, points are counted in units of the last digit
+    if precision is None:
+        unit = 1.0
+    else:
+        unit = 10.0 ** precision
+
+    chunks = []
+    last = None
+    x0 = y0 = 0
+    for command, args in commands:
+        if precision is None:
+            points = args
+        else:
+            points = [int(round(a * unit)) for a in args]
 
+        if command == 'M':
+            numbers = points
+            letter = 'M'
+        else:
+            numbers = [
+                value - origin
+                for value, origin in zip(points, (x0, y0) * len(points))
+            ]
+            letter = command.lower()
+        if points:
+            x0, y0 = points[-2], points[-1]
 
+        texts = [str(value / unit) for value in numbers]
+        text = ' '.join([t[:-2] if t.endswith('.0') else t for t in texts])
 
+        # a repeated command may leave out its letter, except M, whose
+        # repetitions would be read as L
+        if numbers and letter == last and not letter == 'M':
+            chunks.append(' ' + text)
+        else:
+            chunks.append(letter + text)
+        last = letter
+
+    # a minus sign separates numbers as well as a space does
+    return ''.join(chunks).replace(' -', '-')
+
+def format_number(value, precision=None):
+    'formats value with at most precision digits after the decimal point\n'
+    '(None: as many as str() gives), without trailing zeros.'
+    if precision is not None:
+        unit = 10.0 ** precision
+        value = int(round(value * unit)) / unit
+    return _trim_number(str(float(value)))
+
+def _trim_number(text):
+    if text.endswith('.0'):
+        text = text[:-2]
+    if text == '-0':
+        text = '0'
+    return text